@@ -0,0 +1,162 @@
+"""Persisted per-athlete index of Strava summary activities, kept up to date incrementally.
+
+The index lives in ``cache/<athlete_id>/activities.parquet`` and its sync state in ``activities_sync.json``. A sync
+only lists the activities that started after the newest one already indexed. Every ``RECONCILE_INTERVAL`` the whole
+requested period is listed again instead, replacing its part of the index, so renamed, edited, deleted and late
+uploaded activities are picked up. A period reaching further back than the index covers is listed in full once.
+"""
+
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+import stravalib.client
+from file_lock import unique_tmp_path
+from single_flight import SingleFlight
+from stravalib import model
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_INDEX_FILENAME = "activities.parquet"
+SYNC_STATE_FILENAME = "activities_sync.json"
+RECONCILE_INTERVAL = timedelta(hours=24)
+
+# Serialize the read-modify-write of the index between Streamlit sessions
+_lock = threading.Lock()
+# Sessions of the same athlete share a sync in flight
+_sync_flights = SingleFlight()
+
+
+@dataclass
+class SyncState:
+    """Coverage of the index, as epoch seconds."""
+
+    path: Path
+    # Start of the oldest period listed in full
+    synced_after: Optional[int] = None
+    # Start of the newest indexed activity, incremental syncs list the activities after it
+    cursor: Optional[int] = None
+    reconciled_at: Optional[int] = None
+
+    @classmethod
+    def load(cls, path: Path) -> "SyncState":
+        if not path.exists():
+            return cls(path)
+        state = json.loads(path.read_text())
+        return cls(path, state["synced_after"], state["cursor"], state["reconciled_at"])
+
+    def save(self):
+        state = {"synced_after": self.synced_after, "cursor": self.cursor, "reconciled_at": self.reconciled_at}
+        tmp_path = unique_tmp_path(self.path)
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(self.path)
+
+
+def _empty_index() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "name": pd.Series(dtype="object"),
+            "type": pd.Series(dtype="object"),
+            "start_date": pd.Series(dtype="datetime64[ns]"),
+            "start_date_local": pd.Series(dtype="datetime64[ns]"),
+            "distance": pd.Series(dtype="float64"),
+            "moving_time": pd.Series(dtype="int64"),
+            "elapsed_time": pd.Series(dtype="int64"),
+            "total_elevation_gain": pd.Series(dtype="float64"),
+        },
+        index=pd.Index([], dtype="int64", name="activity_id"),
+    )
+
+
+def _to_index(activities: List[model.SummaryActivity]) -> pd.DataFrame:
+    """Summary fields of activities, start dates as naive UTC and local wall-clock times."""
+    if not activities:
+        return _empty_index()
+    index = pd.DataFrame(
+        [
+            {
+                "activity_id": activity.id,
+                "name": activity.name,
+                "type": getattr(activity.type, "root", activity.type),
+                "start_date": pd.Timestamp(activity.start_date).tz_convert(None),
+                "start_date_local": pd.Timestamp(activity.start_date_local).replace(tzinfo=None),
+                "distance": float(activity.distance or 0),
+                "moving_time": int(activity.moving_time or 0),
+                "elapsed_time": int(activity.elapsed_time or 0),
+                "total_elevation_gain": float(activity.total_elevation_gain or 0),
+            }
+            for activity in activities
+        ]
+    ).set_index("activity_id")
+    return index.astype(_empty_index().dtypes.to_dict())
+
+
+def load_activity_index(cache_dir: Path, user_id: int) -> pd.DataFrame:
+    """Load the persisted activity index of a user, indexed by activity ID."""
+    index_path = cache_dir / str(user_id) / ACTIVITY_INDEX_FILENAME
+    if not index_path.exists():
+        return _empty_index()
+    return pd.read_parquet(index_path)
+
+
+def _epoch(date: pd.Timestamp) -> int:
+    return int(date.tz_localize(timezone.utc).timestamp())
+
+
+def _sync(client: stravalib.client.Client, cache_dir: Path, user_id: int, days: int) -> pd.DataFrame:
+    user_cache_dir = cache_dir / str(user_id)
+    now = datetime.now(timezone.utc)
+    after = now - timedelta(days=days)
+    with _lock:
+        index = load_activity_index(cache_dir, user_id)
+        state = SyncState.load(user_cache_dir / SYNC_STATE_FILENAME)
+        full = (
+            state.synced_after is None
+            or state.synced_after > after.timestamp()
+            or state.reconciled_at is None
+            or now.timestamp() - state.reconciled_at >= RECONCILE_INTERVAL.total_seconds()
+        )
+        list_after = after if full else datetime.fromtimestamp(state.cursor or state.synced_after, tz=timezone.utc)
+        listed = _to_index(list(client.get_activities(before=now, after=list_after)))
+        logger.info(
+            "Listed %d activities since %s for user %s (%s)",
+            len(listed),
+            list_after,
+            user_id,
+            "full" if full else "new",
+        )
+
+        if full:
+            # Activities of the listed period missing from the listing were deleted
+            listed_period = index["start_date"] >= list_after.replace(tzinfo=None)
+            index = index[~listed_period]
+        index = pd.concat([index.drop(index=listed.index, errors="ignore"), listed]).sort_values("start_date")
+
+        if full:
+            state.synced_after = int(min(after.timestamp(), state.synced_after or after.timestamp()))
+            state.reconciled_at = int(now.timestamp())
+        if not index.empty:
+            state.cursor = _epoch(index["start_date"].max())
+        user_cache_dir.mkdir(parents=True, exist_ok=True)
+        index_path = user_cache_dir / ACTIVITY_INDEX_FILENAME
+        tmp_path = unique_tmp_path(index_path)
+        index.to_parquet(tmp_path)
+        tmp_path.replace(index_path)
+        state.save()
+        return index
+
+
+def sync_activity_index(client: stravalib.client.Client, cache_dir: Path, user_id: int, days: int) -> pd.DataFrame:
+    """Bring the user's activity index up to date for the past days and return the whole index."""
+    index, _ = _sync_flights.do((cache_dir, user_id, days), _sync, client, cache_dir, user_id, days)
+    return index
+
+
+def get_rides(index: pd.DataFrame, start_date: datetime) -> pd.DataFrame:
+    """Rides of the index that started at or after a local date."""
+    return index[(index["type"] == "Ride") & (index["start_date_local"] >= pd.Timestamp(start_date))]
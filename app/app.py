@@ -1,6 +1,5 @@
 import logging
 import os
-from collections import defaultdict
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -9,9 +8,24 @@ import pandas as pd
 import stravalib
 import stravalib.client
 import streamlit as st
-from common import Colors, filter_ride_activities, get_tss, load_cached_data
+from activity_index import get_rides, sync_activity_index
+from common import (
+    Colors,
+    get_activity_store,
+    update_manifest,
+)
+from frame_cache import DEFAULT_MAX_BYTES, stream_cache
 from PIL import Image
+from power_curve import (
+    get_best_power_curve,
+    get_best_power_curve_since,
+    update_power_curves,
+)
+from rollup import get_rollup, update_daily_rollup
 from streamlit_oauth import OAuth2Component
+from streams import DEFAULT_MAX_WORKERS, fetch_activity_dfs
+from training_load import get_training_load_window, update_training_load_state
+from ttl_cache import TTLCache
 
 # Initialize logger
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
@@ -30,6 +44,17 @@ st.set_page_config(page_title="Ferociter", page_icon=ferociter_logo)
 CACHE_DIR = Path("cache")
 CACHE_DIR.mkdir(exist_ok=True)
 
+# Number of activities whose streams are downloaded from Strava in parallel, 1 to fetch serially
+STREAM_FETCH_WORKERS = int(os.environ.get("STREAM_FETCH_WORKERS", DEFAULT_MAX_WORKERS))
+# Memory shared by all sessions for the streams of stored activities
+STREAM_CACHE_MAX_BYTES = int(os.environ.get("STREAM_CACHE_MAX_MB", DEFAULT_MAX_BYTES // 2**20)) * 2**20
+stream_cache.set_max_bytes(STREAM_CACHE_MAX_BYTES)
+
+# Seconds Strava responses are reused for within a session, widget changes re-render from memory
+ATHLETE_TTL = float(os.environ.get("STRAVA_ATHLETE_TTL", 3600))
+ATHLETE_STATS_TTL = float(os.environ.get("STRAVA_ATHLETE_STATS_TTL", 900))
+ACTIVITIES_TTL = float(os.environ.get("STRAVA_ACTIVITIES_TTL", 300))
+
 
 class StravaOAuth2Component(OAuth2Component):
     """Solution from https://github.com/dnplus/streamlit-oauth/issues/59"""
@@ -72,12 +97,17 @@ else:
     os.environ["STRAVA_CLIENT_ID"] = st.secrets.strava.client_id
     os.environ["STRAVA_CLIENT_SECRET"] = st.secrets.strava.client_secret
     client = stravalib.client.Client(access_token=st.session_state["token"]["access_token"])
-    athlete = client.get_athlete()
+    strava_cache = st.session_state.setdefault("strava_cache", TTLCache())
+    if st.button("Refresh from Strava", help="Fetch your profile, stats and activities again."):
+        strava_cache.invalidate()
+    athlete = strava_cache.get(("athlete",), client.get_athlete, ATHLETE_TTL)
     st.write("Authenticated with Strava ✅")
     st.image(athlete.profile, width=100)
     st.subheader(f"Welcome back, {athlete.firstname}!")
     st.header("All Time Efforts 🏆")
-    stats = client.get_athlete_stats(athlete.id)
+    stats = strava_cache.get(
+        ("athlete_stats", athlete.id), lambda: client.get_athlete_stats(athlete.id), ATHLETE_STATS_TTL
+    )
     all_ride_totals = stats.all_ride_totals
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -107,48 +137,37 @@ else:
     user_time_period = st.number_input("Time Period (days)", min_value=1, max_value=365, value=90, step=1)
 
     activity_id_to_date = {}
-    activity_id_to_df = load_cached_data(CACHE_DIR, athlete.id)
 
     # === Weekly TSS Graph ===
     epoch_time_0 = int((datetime.now() - timedelta(days=user_time_period)).timestamp())
     epoch_time_1 = int(datetime.now().timestamp())
 
     with st.spinner("Loading activities data...", show_time=True):
-        activities_data = client.get_activities(
-            before=datetime.now(), after=datetime.now() - timedelta(days=user_time_period)
+        activity_index = strava_cache.get(
+            ("activities", athlete.id, user_time_period),
+            lambda: sync_activity_index(client, CACHE_DIR, athlete.id, user_time_period),
+            ACTIVITIES_TTL,
         )
-        ride_activities = filter_ride_activities(activities_data)
-        ride_activities_id = [activity.id for activity in ride_activities]
-        for activity in ride_activities:
-            activity_id_to_date[activity.id] = activity.start_date_local
-        # filter out activities in cache but out of time range
-        activity_id_to_df = {
-            activity_id: df for activity_id, df in activity_id_to_df.items() if activity_id in activity_id_to_date
-        }
-
-        stream_types = ["time", "distance", "velocity_smooth", "watts", "cadence"]
+        ride_activities = get_rides(activity_index, datetime.now() - timedelta(days=user_time_period))
+        ride_activities_id = ride_activities.index.tolist()
+        activity_id_to_date.update(ride_activities["start_date_local"].to_dict())
+        # date cached activities imported from before the manifest existed
+        update_manifest(CACHE_DIR, athlete.id, activity_id_to_date)
+        cached_activity_ids = get_activity_store(CACHE_DIR, athlete.id).activity_ids()
+
+        missing_activity_id_to_date = {}
         for activity_id in ride_activities_id:
-            if activity_id in activity_id_to_df:
-                logger.info("Cached activity %s loaded for user %s.", activity_id, athlete.id)
+            if activity_id in cached_activity_ids:
+                logger.info("Cached activity %s found for user %s.", activity_id, athlete.id)
                 continue
-            activity_stream = client.get_activity_streams(activity_id, types=stream_types)
-            df = pd.DataFrame(
-                {stream_type: stream.data for stream_type, stream in activity_stream.items() if stream is not None}
-            )
-            try:
-                user_cache_dir = CACHE_DIR / str(athlete.id)
-                user_cache_dir.mkdir(exist_ok=True, parents=True)
-                cache_path = user_cache_dir / f"{activity_id}.parquet"
-                logger.info("Caching DataFrame to Parquet @ %s", cache_path)
-                df.to_parquet(cache_path)
-            except Exception as e:
-                logger.error("Failed to save DataFrame to Parquet: %s", e, exc_info=True)
-            activity_id_to_df[activity_id] = df
-
-        assert len(activity_id_to_df) == len(activity_id_to_date), (
-            f"Mismatch between activity_id_to_df and activity_id_to_date lengths: "
-            f"{len(activity_id_to_df)} vs {len(activity_id_to_date)}"
+            missing_activity_id_to_date[activity_id] = activity_id_to_date[activity_id]
+        activity_id_to_df = fetch_activity_dfs(
+            client, missing_activity_id_to_date, CACHE_DIR, athlete.id, max_workers=STREAM_FETCH_WORKERS
         )
+        # Metrics don't depend on FTP, streams are only read for rides without persisted metrics
+        daily_rollup = update_daily_rollup(CACHE_DIR, athlete.id, activity_id_to_df)
+        power_curves, power_curve_bests = update_power_curves(CACHE_DIR, athlete.id, activity_id_to_df)
+        logger.info("Stream cache: %s", stream_cache.stats())
         st.toast("Activities data loaded successfully!", icon="✅")
     st.success(f"Showing data for past {user_time_period} days: {len(ride_activities)} rides")
 
@@ -156,26 +175,8 @@ else:
     today = datetime.today()
     weeks = pd.date_range(end=today, periods=52, freq="W-MON").to_pydatetime()
 
-    # Use activity_id_to_date and activity_id_to_df
-    start_times = [activity_id_to_date[activity_id] for activity_id in activity_id_to_df.keys()]
-    l_tss = [get_tss(activity_id_to_df[activity_id], user_input_ftp) for activity_id in activity_id_to_df.keys()]
-    weekly_tss = [0.0] * len(weeks)
-
-    # Create mapping from week date to index
-    index_map = {week.date(): idx for idx, week in enumerate(weeks)}
-
-    # Accumulate TSS values into appropriate weeks
-    for start_time, tss in zip(start_times, l_tss):
-        # Calculate Monday of the week for this activity
-        activity_date = start_time.date()
-        days_since_monday = activity_date.weekday()  # Monday = 0
-        week_monday = activity_date - timedelta(days=days_since_monday)
-
-        # Add TSS to corresponding week
-        if week_monday in index_map:
-            weekly_tss[index_map[week_monday]] += round(tss, 1)
-
-    df_tss = pd.DataFrame({"Week": [week.date() for week in weeks], "TSS": weekly_tss}).set_index("Week")
+    weekly_rollup = get_rollup(daily_rollup, user_input_ftp, weeks[0], today, freq="W-MON")
+    df_tss = weekly_rollup[["TSS"]].round(1).set_index(pd.Index(weekly_rollup.index.date, name="Week"))
 
     st.header("Weekly Training Stress Score 📅")
     st.bar_chart(df_tss, color=Colors.ORANGE, use_container_width=True)
@@ -216,28 +217,10 @@ else:
     # === Performance Management Chart ===
     st.header("Performance Management Chart 📊")
 
-    a_ctl = 2 / (42 + 1)
-    a_atl = 2 / (7 + 1)
-
-    date_to_tss = defaultdict(lambda: 0.0)
-    for tss, start_time in zip(l_tss, start_times):
-        date = start_time.date()
-        date_to_tss[date] += tss
-
     start_date = datetime.today() - timedelta(days=user_time_period)
-    training_load = {"Date": [], "CTL": [], "ATL": [], "TSB": []}
-    for i in range(user_time_period + 1):
-        date = start_date + timedelta(days=i)
-        training_load["Date"].append(date)
-        last_ctl = training_load["CTL"][-1] if training_load["CTL"] else 0
-        last_atl = training_load["ATL"][-1] if training_load["ATL"] else 0
-        current_ctl = last_ctl * (1 - a_ctl) + date_to_tss.get(date.date(), 0) * a_ctl
-        current_atl = last_atl * (1 - a_atl) + date_to_tss.get(date.date(), 0) * a_atl
-        training_load["TSB"].append(current_ctl - current_atl)
-        training_load["CTL"].append(current_ctl)
-        training_load["ATL"].append(current_atl)
-
-    training_load_df = pd.DataFrame(training_load).set_index("Date")
+    # CTL and ATL carry over from all cached history, only days since the last update are recomputed
+    training_load_state = update_training_load_state(CACHE_DIR, athlete.id, daily_rollup["stress"])
+    training_load_df = get_training_load_window(training_load_state, user_input_ftp, start_date, datetime.today())
     training_load_df.reset_index(inplace=True)
     base = (
         alt.Chart(training_load_df)
@@ -289,6 +272,37 @@ else:
         st.caption("- Most coaches generally guide towards maintaining TSB value above -30.")
         st.caption("- Closer to 0 TSB indicates peak performance, recommended for race day.")
 
+    # === Power Duration Curve ===
+    st.header("Power Duration Curve 💪")
+
+    season = str(today.year)
+    best_curves = {
+        "All-time": get_best_power_curve(power_curve_bests),
+        f"Season {season}": get_best_power_curve(power_curve_bests, season),
+        "Last 90 days": get_best_power_curve_since(power_curves, today - timedelta(days=90)),
+    }
+    power_curve_df = pd.concat(
+        [best_curve["power"].rename(label) for label, best_curve in best_curves.items()], axis=1
+    ).reset_index(names="Duration")
+    power_curve_chart = (
+        alt.Chart(power_curve_df)
+        .transform_fold(list(best_curves), as_=["Best", "Power"])
+        .mark_line()
+        .encode(
+            x=alt.X("Duration:Q", title="Duration (s)", scale=alt.Scale(type="log")),
+            y=alt.Y("Power:Q", title="Max Power (W)"),
+            color=alt.Color(
+                "Best:N", scale=alt.Scale(domain=list(best_curves), range=[Colors.BLUE, Colors.ORANGE, Colors.PINK])
+            ),
+            tooltip=["Best:N", "Duration:Q", alt.Tooltip("Power:Q", format=".0f")],
+        )
+    )
+    st.altair_chart(power_curve_chart, use_container_width=True)
+
+    season_best = best_curves[f"Season {season}"]["power"]
+    for col, (label, duration) in zip(st.columns(4), [("5s", 5), ("1m", 60), ("5m", 300), ("20m", 1200)]):
+        col.metric(f"Season Best {label}", f"{season_best[duration]:.0f} W" if duration in season_best.index else "-")
+
 # === Copyright Footer ====
 st.divider()
 st.image("logos/api_logo_pwrdBy_strava_stack_white.png", width=100)
@@ -0,0 +1,240 @@
+"""Headless backfill of an athlete's full Strava ride history into the dashboard cache.
+
+Lists every activity with ``get_activities`` and downloads ride streams newest first into ``cache/<athlete_id>/``,
+the same layout ``load_cached_data`` reads. Progress is checkpointed so the job can resume after a crash, a
+``Ctrl+C`` or an exhausted daily request budget.
+
+    STRAVA_CLIENT_ID=... STRAVA_CLIENT_SECRET=... python backfill.py --access-token <token> --refresh-token <token>
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import stravalib.client
+from common import filter_ride_activities, get_activity_store
+from file_lock import unique_tmp_path
+from power_curve import update_power_curves
+from rollup import update_daily_rollup
+from stravalib.exc import Fault
+from stravalib.util.limiter import (
+    RateLimiter,
+    RequestRate,
+    get_rates_from_response_headers,
+    get_seconds_until_next_day,
+    get_seconds_until_next_quarter,
+)
+from streams import fetch_activity_df
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+logger = logging.getLogger("backfill")
+
+CACHE_DIR = Path("cache")
+CHECKPOINT_FILENAME = "backfill.json"
+# Save the checkpoint after this many listed activities or downloaded streams
+CHECKPOINT_INTERVAL = 20
+
+
+class BudgetExhausted(Exception):
+    """Raised when the daily request budget is used up and the job should stop."""
+
+
+class RequestBudget(RateLimiter):
+    """Rate limiter that tracks the usage reported by Strava's rate-limit response headers.
+
+    ``wait()`` is called before every request: it sleeps until the next 15-minute window when the short-term
+    budget is nearly used, and either sleeps until UTC midnight or raises ``BudgetExhausted`` for the daily one.
+    """
+
+    def __init__(self, reserve: int = 5, wait_for_daily_reset: bool = False):
+        super().__init__()
+        self.reserve = reserve
+        self.wait_for_daily_reset = wait_for_daily_reset
+        self.rate: Optional[RequestRate] = None
+        self.rules.append(self._record)
+
+    def _record(self, headers: Dict[str, str], method: str):
+        rate = get_rates_from_response_headers(headers, method)
+        if rate is not None:
+            self.rate = rate
+
+    def wait(self):
+        if self.rate is None:
+            return
+        if self.rate.long_usage >= self.rate.long_limit - self.reserve:
+            if not self.wait_for_daily_reset:
+                raise BudgetExhausted(f"Daily budget used: {self.rate.long_usage}/{self.rate.long_limit} requests")
+            self.sleep(get_seconds_until_next_day() + 1, "daily")
+        elif self.rate.short_usage >= self.rate.short_limit - self.reserve:
+            self.sleep(get_seconds_until_next_quarter() + 1, "15-minute")
+
+    def sleep(self, seconds: int, window: str):
+        logger.info("Approaching the %s rate limit, sleeping for %d seconds.", window, seconds)
+        time.sleep(seconds)
+        self.rate = None
+
+
+@dataclass
+class Checkpoint:
+    """Resumable backfill state, persisted as JSON next to the athlete's cached activities."""
+
+    path: Path
+    # Epoch seconds of the oldest activity listed so far; listing resumes before it
+    listed_before: Optional[int] = None
+    listing_done: bool = False
+    # Rides still waiting for their streams, as [start epoch seconds, activity id, local start date in ISO format]
+    pending: List[Tuple[int, int, str]] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: Path) -> "Checkpoint":
+        if not path.exists():
+            return cls(path)
+        state = json.loads(path.read_text())
+        return cls(
+            path,
+            listed_before=state["listed_before"],
+            listing_done=state["listing_done"],
+            pending=[tuple(item) for item in state["pending"]],
+        )
+
+    def save(self):
+        state = {"listed_before": self.listed_before, "listing_done": self.listing_done, "pending": self.pending}
+        tmp_path = unique_tmp_path(self.path)
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(self.path)
+
+
+def call_with_budget(budget: RequestBudget, func, *args, **kwargs):
+    """Call a Strava endpoint, waiting for the budget first and retrying once the window resets on HTTP 429.
+
+    stravalib raises a 429 as a plain ``Fault``, ``RateLimitExceeded`` only comes from its own limiter rules.
+    """
+    while True:
+        budget.wait()
+        try:
+            return func(*args, **kwargs)
+        except Fault as e:
+            if e.response is None or e.response.status_code != 429:
+                raise
+            budget.sleep(get_seconds_until_next_quarter() + 1, "15-minute")
+
+
+def list_activities(client: stravalib.client.Client, budget: RequestBudget, checkpoint: Checkpoint, cached: set):
+    """Page through the athlete's history newest to oldest, queueing rides whose streams are not cached."""
+    before = datetime.fromtimestamp(checkpoint.listed_before, tz=timezone.utc) if checkpoint.listed_before else None
+    activities = iter(client.get_activities(before=before))
+    queued = {activity_id for _, activity_id, _ in checkpoint.pending}
+    count = 0
+    while True:
+        activity = call_with_budget(budget, next, activities, None)
+        if activity is None:
+            break
+        start = int(activity.start_date.timestamp())
+        if filter_ride_activities([activity]) and activity.id not in cached and activity.id not in queued:
+            checkpoint.pending.append((start, activity.id, activity.start_date_local.isoformat()))
+            queued.add(activity.id)
+        checkpoint.listed_before = start
+        count += 1
+        if count % CHECKPOINT_INTERVAL == 0:
+            checkpoint.save()
+    checkpoint.listing_done = True
+    checkpoint.save()
+    logger.info("Listed %d activities, %d rides waiting for streams.", count, len(checkpoint.pending))
+
+
+def download_streams(
+    client: stravalib.client.Client, budget: RequestBudget, checkpoint: Checkpoint, cache_dir: Path, athlete_id: int
+):
+    """Download pending ride streams, newest first, appending them to the store, rollup and power curves once per checkpoint.
+
+    The checkpoint only drops rides once they are in the store, errors writing them propagate and stop the job.
+    """
+    store = get_activity_store(cache_dir, athlete_id)
+    heap = [(-start, activity_id, start_date_local) for start, activity_id, start_date_local in checkpoint.pending]
+    heapq.heapify(heap)
+    activity_id_to_df, activity_id_to_date = {}, {}
+    count = 0
+    try:
+        while heap:
+            _, activity_id, start_date_local = heapq.heappop(heap)
+            activity_id_to_df[activity_id] = call_with_budget(budget, fetch_activity_df, client, activity_id)
+            activity_id_to_date[activity_id] = datetime.fromisoformat(start_date_local)
+            count += 1
+            if count % CHECKPOINT_INTERVAL == 0 or not heap:
+                # Taken out of the batch first, so a failed append is not retried below and stays pending
+                appended, appended_dates = activity_id_to_df, activity_id_to_date
+                activity_id_to_df, activity_id_to_date = {}, {}
+                store.append(appended, appended_dates)
+                checkpoint.pending = [(-neg_start, pending_id, date) for neg_start, pending_id, date in heap]
+                checkpoint.save()
+                # Rebuilt from the manifest on the next update if they fail
+                update_daily_rollup(cache_dir, athlete_id, appended)
+                update_power_curves(cache_dir, athlete_id, appended)
+                logger.info("Downloaded %d streams, %d remaining.", count, len(heap))
+    finally:
+        # Keep what was downloaded since the last checkpoint, resuming skips activities already in the store
+        store.append(activity_id_to_df, activity_id_to_date)
+
+
+def main(args):
+    budget = RequestBudget(reserve=args.reserve, wait_for_daily_reset=args.wait_for_daily_reset)
+    client = stravalib.client.Client(
+        access_token=args.access_token,
+        refresh_token=args.refresh_token,
+        token_expires=args.token_expires,
+        rate_limiter=budget,
+    )
+    athlete = call_with_budget(budget, client.get_athlete)
+    user_cache_dir = args.cache_dir / str(athlete.id)
+    user_cache_dir.mkdir(exist_ok=True, parents=True)
+    checkpoint = Checkpoint.load(user_cache_dir / CHECKPOINT_FILENAME)
+    cached = get_activity_store(args.cache_dir, athlete.id).activity_ids()
+    # Streams downloaded after the last checkpoint of a stopped run are already in the store
+    checkpoint.pending = [item for item in checkpoint.pending if item[1] not in cached]
+    logger.info("Backfilling athlete %s, %d activities already cached.", athlete.id, len(cached))
+
+    try:
+        if not checkpoint.listing_done:
+            list_activities(client, budget, checkpoint, cached)
+        download_streams(client, budget, checkpoint, args.cache_dir, athlete.id)
+    except (BudgetExhausted, KeyboardInterrupt) as e:
+        checkpoint.save()
+        logger.warning("Backfill stopped (%s), run again to resume from %s.", str(e) or "interrupted", checkpoint.path)
+        sys.exit(1)
+    logger.info("Backfill completed for athlete %s.", athlete.id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill an athlete's full Strava ride history into the cache.")
+    parser.add_argument(
+        "--access-token", type=str, default=os.environ.get("STRAVA_ACCESS_TOKEN"), help="Strava access token."
+    )
+    parser.add_argument(
+        "--refresh-token",
+        type=str,
+        default=os.environ.get("STRAVA_REFRESH_TOKEN"),
+        help="Strava refresh token, used with STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET to renew the access token.",
+    )
+    parser.add_argument("--token-expires", type=int, default=None, help="Expiry of the access token in epoch seconds.")
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR, help="Cache directory of the dashboard.")
+    parser.add_argument(
+        "--reserve",
+        type=int,
+        default=5,
+        help="Requests of each rate-limit window left unused for the dashboard (default is 5).",
+    )
+    parser.add_argument(
+        "--wait-for-daily-reset",
+        action="store_true",
+        help="Sleep until the daily budget resets instead of stopping when it runs out.",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -1,12 +1,21 @@
 import logging
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Set
 
+import numpy as np
 import pandas as pd
+from single_flight import SingleFlight
+from store import ActivityStore
 from stravalib import model
+from summary import RideSummary, get_ride_summary
 
 logger = logging.getLogger(__name__)
 
+# User cache directories already migrated and upgraded by this process, sessions of a user share the one in flight
+_prepared_stores: Set[Path] = set()
+_prepare_flights = SingleFlight()
+
 
 class Colors:
     GREY = "#3f3f3f"
@@ -19,16 +28,67 @@ class Colors:
     BLUE = "#1D1BF9"
 
 
-def load_cached_data(cache_dir: Path, user_id: int):
-    """Load all Parquet files from the cache directory as a dictionary."""
+def _prepare_activity_store(store: ActivityStore):
+    store.migrate()
+    store.upgrade()
+    _prepared_stores.add(store.user_cache_dir.resolve())
+
+
+def get_activity_store(cache_dir: Path, user_id: int) -> ActivityStore:
+    """Open the user's activity store.
+
+    The first call for a user directory in this process imports any legacy one-file-per-activity cache and upgrades
+    old streams, later calls only open the store.
+    """
+    store = ActivityStore(cache_dir, user_id)
+    key = store.user_cache_dir.resolve()
+    if key not in _prepared_stores:
+        _prepare_flights.do(key, _prepare_activity_store, store)
+    return store
+
+
+def update_manifest(cache_dir: Path, user_id: int, activity_id_to_date: Dict[int, datetime]):
+    """Record the start dates of cached activities that were imported without one."""
+    get_activity_store(cache_dir, user_id).set_start_dates(activity_id_to_date)
+
+
+def load_cached_data(
+    cache_dir: Path,
+    user_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    columns: Optional[List[str]] = None,
+) -> Dict[int, pd.DataFrame]:
+    """Load the cached activities of a user as a dictionary of activity ID to DataFrame.
+
+    Without a date range every cached activity is read. With one, the manifest is used to read only the activities
+    that started within it; cached activities without a recorded start date are skipped. ``columns`` restricts the
+    streams read, columns an activity does not have are left out.
+    """
     user_cache_dir = cache_dir / str(user_id)
     if not user_cache_dir.exists():
         logger.info("Cache directory %s does not exist for user %d", user_cache_dir, user_id)
         return {}
-    parquet_files = list(user_cache_dir.glob("*.parquet"))
-    logger.info("Loading cached data from %s", user_cache_dir)
-    activity_id_to_df = {int(file.stem): pd.read_parquet(file) for file in parquet_files}
-    return activity_id_to_df
+    store = get_activity_store(cache_dir, user_id)
+    activity_ids = store.select(start_date, end_date)
+    logger.info("Loading %d cached activities from %s", len(activity_ids), user_cache_dir)
+    return store.read(activity_ids, columns)
+
+
+def save_cached_data(
+    cache_dir: Path,
+    user_id: int,
+    activity_id_to_df: Dict[int, pd.DataFrame],
+    activity_id_to_date: Dict[int, datetime],
+):
+    """Append activity DataFrames to the user's activity store."""
+    if not activity_id_to_df:
+        return
+    try:
+        logger.info("Caching %d DataFrames to the activity store of user %s", len(activity_id_to_df), user_id)
+        get_activity_store(cache_dir, user_id).append(activity_id_to_df, activity_id_to_date)
+    except Exception as e:
+        logger.error("Failed to save DataFrames to the activity store: %s", e, exc_info=True)
 
 
 def filter_ride_activities(activities_data: List[model.SummaryActivity]) -> List[model.SummaryActivity]:
@@ -37,10 +97,22 @@ def filter_ride_activities(activities_data: List[model.SummaryActivity]) -> List
     return ride_activities
 
 
-def get_tss(df: pd.DataFrame, ftp: float) -> float:
-    # moving_time_seconds = df[df["speed"] > 0].shape[0]
-    pwr_rollings = df["watts"].rolling(window=30).mean().dropna()
-    normalized_power = (pwr_rollings**4).mean() ** 0.25
+def get_tss_from_normalized_power(normalized_power, duration, ftp: float):
+    """TSS from normalized power and duration in seconds, works element-wise on Series of many activities."""
     intensity_factor = normalized_power / ftp
-    tss = intensity_factor**2 * len(df) / 3600 * 100
-    return tss
+    return intensity_factor**2 * duration / 3600 * 100
+
+
+def _stream_values(df: pd.DataFrame, column: str) -> np.ndarray:
+    """Stream as float64 with NaN for missing samples, whatever compact type it is stored with."""
+    return df[column].to_numpy(dtype="float64", na_value=np.nan)
+
+
+def get_activity_summary(df: pd.DataFrame) -> RideSummary:
+    """Summary of an activity's Strava streams, streams the activity does not have are left out."""
+    streams = {"watts": "power", "velocity_smooth": "speed", "cadence": "cadence", "altitude": "elevation"}
+    return get_ride_summary(
+        **{name: _stream_values(df, column) for column, name in streams.items() if column in df.columns},
+        distance=_stream_values(df, "distance") if "distance" in df.columns else None,
+        num_samples=len(df),
+    )
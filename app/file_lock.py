@@ -0,0 +1,72 @@
+"""Locking of a user cache directory between threads and processes.
+
+The dashboard serves every session from threads of one process while ``backfill.py`` runs as a process of its own,
+and both rewrite the same manifest, metrics, rollup, power curve and training load files. Their read-modify-writes
+hold the user's lock, an exclusive ``flock`` of ``cache/<athlete_id>/.lock``, and files are written under a name
+unique to the writing process and thread before they replace the old one.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock, e.g. on Windows, the lock only serializes the threads of one process
+    fcntl = None
+
+LOCK_FILENAME = ".lock"
+
+
+class UserLock:
+    """Exclusive lock of a user cache directory, reentrant within a thread."""
+
+    def __init__(self, user_cache_dir: Path):
+        self.path = user_cache_dir / LOCK_FILENAME
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self) -> "UserLock":
+        self._lock.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a")
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            # Closing the file releases the flock
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+_user_locks: Dict[Path, UserLock] = {}
+_user_locks_lock = threading.Lock()
+
+
+def user_lock(user_cache_dir: Path) -> UserLock:
+    """The lock of a user cache directory, shared by every thread of the process."""
+    key = user_cache_dir.resolve()
+    with _user_locks_lock:
+        if key not in _user_locks:
+            _user_locks[key] = UserLock(user_cache_dir)
+        return _user_locks[key]
+
+
+def unique_tmp_path(path: Path) -> Path:
+    """Temporary path next to a file, unique per process and thread, e.g. the dashboard and a backfill job."""
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
@@ -0,0 +1,95 @@
+"""Process-wide, memory-bounded LRU cache of DataFrames.
+
+Streamlit runs every session as a thread of the same process, so a single cache lets all sessions share one copy of
+an athlete's streams instead of each holding its own. Frames are handed out as shallow copies, which are only safe
+to share with pandas' copy-on-write: a session that modifies one, e.g. by setting a value or adding a column, then
+gets its own data and never changes the cached frame. Copy-on-write is always on from pandas 3 and is switched on
+here for older versions, so every process that caches frames has it.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Dict, Hashable, Optional
+
+import pandas as pd
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+@dataclass
+class FrameCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    num_frames: int = 0
+    num_bytes: int = 0
+    max_bytes: int = 0
+
+
+class FrameCache:
+    """Least recently used DataFrames up to a total of ``max_bytes``, safe to use from many threads."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._frames: "OrderedDict[Hashable, pd.DataFrame]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self._stats = FrameCacheStats(max_bytes=max_bytes)
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """The cached frame of a key, None on a miss."""
+        with self._lock:
+            df = self._frames.get(key)
+            if df is None:
+                self._stats.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self._stats.hits += 1
+        return df.copy(deep=False)
+
+    def put(self, key: Hashable, df: pd.DataFrame):
+        """Cache a frame, evicting the least recently used ones beyond the budget. Frames over budget are not kept."""
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            self._pop(key)
+            if size > self._stats.max_bytes:
+                return
+            self._frames[key] = df.copy(deep=False)
+            self._sizes[key] = size
+            self._stats.num_bytes += size
+            self._evict()
+
+    def set_max_bytes(self, max_bytes: int):
+        with self._lock:
+            self._stats.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._sizes.clear()
+            self._stats.num_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counts and the current and maximum size."""
+        with self._lock:
+            self._stats.num_frames = len(self._frames)
+            return asdict(self._stats)
+
+    def _pop(self, key: Hashable):
+        if key in self._frames:
+            del self._frames[key]
+            self._stats.num_bytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self._stats.num_bytes > self._stats.max_bytes:
+            key = next(iter(self._frames))
+            self._pop(key)
+            self._stats.evictions += 1
+
+
+# Streams of stored activities, keyed by user cache directory, activity ID and stream hash
+stream_cache = FrameCache()
@@ -0,0 +1,43 @@
+"""Mean-maximal power, the best average power of a ride over each duration, shared by the dashboard and legacy app."""
+
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+def get_power_curve_durations(max_duration: int, num: int = 100) -> np.ndarray:
+    """Log-spaced grid of whole-second durations from 1s to max_duration, every second is ``np.arange(1, n + 1)``."""
+    if max_duration < 1:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.geomspace(1, max_duration, num).round().astype(np.int64))
+
+
+def get_mean_max_power(power: np.ndarray, durations: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Best average power of a 1 Hz power stream over each duration in seconds, NaN for durations beyond the ride.
+
+    Every window average is a difference of the cumulative sum, so each duration is a single O(n) pass with one
+    scratch buffer. Missing samples count as 0 W.
+    """
+    power = np.nan_to_num(np.asarray(power, dtype=np.float64))
+    cumsum = np.zeros(len(power) + 1)
+    np.cumsum(power, out=cumsum[1:])
+    buffer = np.empty(len(power))
+    if out is None:
+        out = np.empty(len(durations))
+    for idx, duration in enumerate(durations):
+        num_windows = len(power) - duration + 1
+        if duration < 1 or num_windows < 1:
+            out[idx] = np.nan
+            continue
+        windows = np.subtract(cumsum[duration:], cumsum[:num_windows], out=buffer[:num_windows])
+        out[idx] = windows.max() / duration
+    return out
+
+
+def get_mean_max_powers(powers: Iterable[np.ndarray], durations: np.ndarray) -> np.ndarray:
+    """Mean-maximal power curves of many rides over the same durations, as a (rides, durations) array."""
+    powers = list(powers)
+    curves = np.empty((len(powers), len(durations)))
+    for idx, power in enumerate(powers):
+        get_mean_max_power(power, durations, out=curves[idx])
+    return curves
@@ -0,0 +1,111 @@
+"""FTP-independent per-activity metrics, persisted next to the activity store.
+
+Normalized power, duration, work, moving time and distance only depend on an activity's streams, so they are
+computed once per activity and stored in ``cache/<athlete_id>/metrics.parquet`` with the hash of the streams they
+were computed from. The daily rollup derives training stress from them with ``get_tss_from_normalized_power``, so
+TSS for any FTP never touches the streams.
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from common import get_activity_store, get_activity_summary
+from file_lock import unique_tmp_path
+from resample import get_recorded_time
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILENAME = "metrics.parquet"
+METRIC_COLUMNS = ["normalized_power", "duration", "kilojoules", "moving_time", "distance"]
+
+
+def load_metrics(cache_dir: Path, user_id: int) -> pd.DataFrame:
+    """Load the persisted activity metrics of a user, indexed by activity ID."""
+    metrics_path = cache_dir / str(user_id) / METRICS_FILENAME
+    if metrics_path.exists():
+        metrics = pd.read_parquet(metrics_path)
+        # Metrics persisted before a column was added are recomputed as a whole
+        if set(METRIC_COLUMNS).issubset(metrics.columns):
+            return metrics
+    return pd.DataFrame(
+        {
+            "stream_hash": pd.Series(dtype="object"),
+            "normalized_power": pd.Series(dtype="float64"),
+            "duration": pd.Series(dtype="int64"),
+            "kilojoules": pd.Series(dtype="float64"),
+            "moving_time": pd.Series(dtype="int64"),
+            "distance": pd.Series(dtype="float64"),
+        },
+        index=pd.Index([], dtype="int64", name="activity_id"),
+    )
+
+
+def _compute_metrics(df: pd.DataFrame) -> Dict[str, float]:
+    summary = get_activity_summary(df)
+    return {
+        "normalized_power": summary.normalized_power,
+        "duration": get_recorded_time(df),
+        "kilojoules": summary.kilojoules,
+        "moving_time": summary.moving_time,
+        # Rides without a distance stream count as 0 km in the rollup
+        "distance": 0.0 if np.isnan(summary.distance) else summary.distance,
+    }
+
+
+def get_activity_metrics(
+    cache_dir: Path,
+    user_id: int,
+    activity_ids: List[int],
+    activity_id_to_df: Optional[Dict[int, pd.DataFrame]] = None,
+) -> pd.DataFrame:
+    """FTP-independent metrics of the given activities, indexed by activity ID.
+
+    Metrics whose stream hash no longer matches the activity store are recomputed and persisted. The streams are
+    taken from ``activity_id_to_df`` when given, e.g. for freshly fetched activities, and read from the store
+    otherwise. Activities that are neither cached nor in ``activity_id_to_df`` are left out.
+    """
+    activity_id_to_df = activity_id_to_df or {}
+    store = get_activity_store(cache_dir, user_id)
+    with store.lock:
+        manifest = store.load_manifest()
+        manifest = manifest[manifest["part"].notna()]
+        stored_ids = [activity_id for activity_id in activity_ids if activity_id in manifest.index]
+        stream_hashes = manifest.loc[stored_ids, "stream_hash"].fillna("")
+
+        metrics = load_metrics(cache_dir, user_id)
+        is_current = metrics["stream_hash"].reindex(stored_ids) == stream_hashes
+        stale_ids = stream_hashes.index[~is_current].tolist()
+        unstored_ids = [
+            activity_id
+            for activity_id in activity_ids
+            if activity_id not in manifest.index and activity_id in activity_id_to_df
+        ]
+        if not stale_ids and not unstored_ids:
+            return metrics.loc[stored_ids]
+
+        missing_dfs = store.read([activity_id for activity_id in stale_ids if activity_id not in activity_id_to_df])
+        new_metrics = pd.DataFrame(
+            [
+                {
+                    "activity_id": activity_id,
+                    "stream_hash": stream_hashes.get(activity_id),
+                    **_compute_metrics(
+                        activity_id_to_df[activity_id] if activity_id in activity_id_to_df else missing_dfs[activity_id]
+                    ),
+                }
+                for activity_id in stale_ids + unstored_ids
+            ]
+        ).set_index("activity_id")
+        logger.info("Computed metrics of %d activities for user %s", len(new_metrics), user_id)
+
+        if stale_ids:
+            # Only activities in the store have a stream hash to validate their metrics against
+            metrics = pd.concat([metrics.drop(index=stale_ids, errors="ignore"), new_metrics.loc[stale_ids]])
+            metrics_path = cache_dir / str(user_id) / METRICS_FILENAME
+            tmp_path = unique_tmp_path(metrics_path)
+            metrics.to_parquet(tmp_path)
+            tmp_path.replace(metrics_path)
+        return pd.concat([metrics.loc[stored_ids], new_metrics.loc[unstored_ids]])
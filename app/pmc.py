@@ -0,0 +1,43 @@
+"""Performance Management Chart kernel, shared by the dashboard and the legacy app.
+
+CTL and ATL are exponential moving averages of daily TSS with 42- and 7-day time constants, TSB is their difference.
+"""
+
+import numpy as np
+
+# Largest power of ten the inverse decay may scale a block by
+MAX_EMA_SCALE_EXPONENT = 100
+
+
+def exponential_moving_average(values: np.ndarray, alpha: float, initial=0.0, block_size: int = 256) -> np.ndarray:
+    """Exponential filter ``y[t] = (1 - alpha) * y[t - 1] + alpha * values[t]`` along the last axis.
+
+    Each block is solved with a cumulative sum of the values scaled by the inverse decay, blocks are shortened for
+    fast decays to keep that scale well inside float64 range. ``initial`` is ``y[-1]``, one value per row for 2-D
+    input.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    decay = 1 - alpha
+    if decay == 0:
+        return values.copy()
+    if decay < 1:
+        block_size = max(1, min(block_size, int(MAX_EMA_SCALE_EXPONENT / -np.log10(decay)) + 1))
+    offsets = np.arange(min(block_size, values.shape[-1]))
+    growth, shrink = decay**-offsets, decay**offsets
+    previous = np.broadcast_to(np.asarray(initial, dtype=np.float64), values.shape[:-1])[..., np.newaxis]
+    result = np.empty_like(values)
+    for start in range(0, values.shape[-1], block_size):
+        block = values[..., start : start + block_size]
+        n = block.shape[-1]
+        result[..., start : start + n] = (
+            alpha * shrink[:n] * np.cumsum(block * growth[:n], axis=-1) + previous * decay * shrink[:n]
+        )
+        previous = result[..., start + n - 1 : start + n]
+    return result
+
+
+def get_pmc(daily_tss: np.ndarray, ctl_days: int = 42, atl_days: int = 7, initial_ctl=0.0, initial_atl=0.0):
+    """CTL, ATL and TSB of daily TSS along the last axis, an (athletes, days) array gives one PMC per athlete."""
+    ctl = exponential_moving_average(daily_tss, 2 / (ctl_days + 1), initial_ctl)
+    atl = exponential_moving_average(daily_tss, 2 / (atl_days + 1), initial_atl)
+    return ctl, atl, ctl - atl
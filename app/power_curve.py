@@ -0,0 +1,168 @@
+"""Persisted mean-maximal power curves of an athlete's rides and an index of their best efforts.
+
+Layout of ``cache/<athlete_id>/``::
+
+    power_curves.parquet        one row per ride: stream hash, start date and best average power over each of
+                                POWER_CURVE_DURATIONS
+    power_curve_bests.parquet   one row per scope and duration: best power and the ride that set it, the scopes are
+                                "all-time" and every season (calendar year)
+
+New rides are merged into the index by element-wise max, it is only rebuilt from the stored curves when the streams
+of an indexed ride changed. Bests over a sliding window such as the last 90 days can't be maintained by a max, they
+are taken from the stored curves at read time, which doesn't touch the streams either.
+"""
+
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from common import get_activity_store
+from file_lock import unique_tmp_path
+from mean_max import get_mean_max_powers, get_power_curve_durations
+
+logger = logging.getLogger(__name__)
+
+POWER_CURVE_FILENAME = "power_curves.parquet"
+POWER_CURVE_BESTS_FILENAME = "power_curve_bests.parquet"
+ALL_TIME = "all-time"
+# Log-spaced up to 6 hours, plus the durations riders quote their bests for
+POWER_CURVE_DURATIONS = np.union1d(get_power_curve_durations(6 * 3600, 60), [5, 10, 30, 60, 300, 600, 1200, 1800, 3600])
+
+
+def _duration_columns() -> List[str]:
+    return [str(duration) for duration in POWER_CURVE_DURATIONS]
+
+
+def load_power_curves(cache_dir: Path, user_id: int) -> pd.DataFrame:
+    """Load the persisted power curves of a user, indexed by activity ID with one column per duration."""
+    curves_path = cache_dir / str(user_id) / POWER_CURVE_FILENAME
+    if curves_path.exists():
+        curves = pd.read_parquet(curves_path)
+        # Curves persisted over another duration grid are recomputed as a whole
+        if curves.columns[2:].tolist() == _duration_columns():
+            return curves
+    return pd.DataFrame(
+        {
+            "stream_hash": pd.Series(dtype="object"),
+            "start_date": pd.Series(dtype="datetime64[ns]"),
+            **{column: pd.Series(dtype="float64") for column in _duration_columns()},
+        },
+        index=pd.Index([], dtype="int64", name="activity_id"),
+    )
+
+
+def _empty_bests() -> pd.DataFrame:
+    return pd.DataFrame(
+        {"power": pd.Series(dtype="float64"), "activity_id": pd.Series(dtype="int64")},
+        index=pd.MultiIndex.from_arrays(
+            [np.array([], dtype="object"), np.array([], dtype="int64")], names=["scope", "duration"]
+        ),
+    )
+
+
+def load_power_curve_bests(cache_dir: Path, user_id: int) -> pd.DataFrame:
+    """Load the best power and the activity that set it, indexed by scope and duration."""
+    bests_path = cache_dir / str(user_id) / POWER_CURVE_BESTS_FILENAME
+    if not bests_path.exists():
+        return _empty_bests()
+    return pd.read_parquet(bests_path)
+
+
+def _get_bests(curves: pd.DataFrame, scopes: pd.Series) -> pd.DataFrame:
+    """Best power of every duration within each scope, ``scopes`` labels each curve with its scope."""
+    bests = []
+    for scope, scope_curves in curves[_duration_columns()].groupby(scopes.to_numpy()):
+        values = scope_curves.to_numpy()
+        best_rows = np.where(np.isnan(values), -np.inf, values).argmax(axis=0)
+        power = values[best_rows, np.arange(values.shape[1])]
+        covered = ~np.isnan(power)
+        bests.append(
+            pd.DataFrame(
+                {
+                    "scope": scope,
+                    "duration": POWER_CURVE_DURATIONS[covered],
+                    "power": power[covered],
+                    "activity_id": scope_curves.index.to_numpy()[best_rows[covered]],
+                }
+            )
+        )
+    if not bests:
+        return _empty_bests()
+    return pd.concat(bests).set_index(["scope", "duration"])
+
+
+def _get_index_bests(curves: pd.DataFrame) -> pd.DataFrame:
+    seasons = curves["start_date"].dt.year.astype(str)
+    return pd.concat([_get_bests(curves, pd.Series(ALL_TIME, index=curves.index)), _get_bests(curves, seasons)])
+
+
+def _save(df: pd.DataFrame, path: Path):
+    tmp_path = unique_tmp_path(path)
+    df.to_parquet(tmp_path)
+    tmp_path.replace(path)
+
+
+def update_power_curves(
+    cache_dir: Path, user_id: int, activity_id_to_df: Optional[Dict[int, pd.DataFrame]] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Compute the curves of cached rides without a current one and merge them into the index.
+
+    Streams are taken from ``activity_id_to_df`` when given and only their power is read from the store otherwise.
+    Returns the curves and the index.
+    """
+    activity_id_to_df = activity_id_to_df or {}
+    store = get_activity_store(cache_dir, user_id)
+    with store.lock:
+        manifest = store.load_manifest()
+        manifest = manifest[manifest["part"].notna() & manifest["start_date"].notna()]
+
+        curves = load_power_curves(cache_dir, user_id)
+        is_current = curves["stream_hash"].reindex(manifest.index) == manifest["stream_hash"].fillna("")
+        stale_ids = manifest.index[~is_current].tolist()
+        if not stale_ids:
+            return curves, load_power_curve_bests(cache_dir, user_id)
+
+        missing_dfs = store.read(
+            [activity_id for activity_id in stale_ids if activity_id not in activity_id_to_df], columns=["watts"]
+        )
+        powers = []
+        for activity_id in stale_ids:
+            df = activity_id_to_df[activity_id] if activity_id in activity_id_to_df else missing_dfs[activity_id]
+            powers.append(
+                df["watts"].to_numpy(dtype="float64", na_value=np.nan) if "watts" in df.columns else np.empty(0)
+            )
+        values = get_mean_max_powers(powers, POWER_CURVE_DURATIONS)
+        new_curves = pd.DataFrame(values, index=pd.Index(stale_ids, name="activity_id"), columns=_duration_columns())
+        new_curves.insert(0, "start_date", manifest.loc[stale_ids, "start_date"])
+        new_curves.insert(0, "stream_hash", manifest.loc[stale_ids, "stream_hash"])
+
+        # A changed ride may have set a best it no longer holds, only new rides can be merged by max
+        rebuild = curves.empty or curves.index.isin(stale_ids).any()
+        curves = pd.concat([curves.drop(index=stale_ids, errors="ignore"), new_curves])
+        if rebuild:
+            bests = _get_index_bests(curves)
+        else:
+            # On ties the ride that set the best first keeps it
+            bests = pd.concat([_get_index_bests(new_curves), load_power_curve_bests(cache_dir, user_id)])
+            bests = bests.sort_values("power", kind="stable").groupby(level=["scope", "duration"]).tail(1)
+        bests = bests.sort_index()
+        _save(curves, cache_dir / str(user_id) / POWER_CURVE_FILENAME)
+        _save(bests, cache_dir / str(user_id) / POWER_CURVE_BESTS_FILENAME)
+        logger.info("Computed power curves of %d activities for user %s", len(stale_ids), user_id)
+    return curves, bests
+
+
+def get_best_power_curve(bests: pd.DataFrame, scope: str = ALL_TIME) -> pd.DataFrame:
+    """Best power and the activity that set it per duration for ``"all-time"`` or a season such as ``"2025"``."""
+    if scope not in bests.index.get_level_values("scope"):
+        return _empty_bests().droplevel("scope")
+    return bests.xs(scope, level="scope")
+
+
+def get_best_power_curve_since(curves: pd.DataFrame, start_date: datetime) -> pd.DataFrame:
+    """Best power and the activity that set it per duration over the rides started since start_date."""
+    recent = curves[curves["start_date"] >= pd.Timestamp(start_date).replace(tzinfo=None)]
+    return get_best_power_curve(_get_bests(recent, pd.Series(ALL_TIME, index=recent.index)))
@@ -0,0 +1,62 @@
+"""Resampling of Strava streams onto a uniform 1 Hz grid.
+
+Strava's ``time`` stream is in whole seconds from the start of the activity but skips seconds: smart recording stores
+a sample every few seconds and auto-pause leaves out the stops. Every metric assumes one sample per second, so the
+streams are resampled once when they are stored:
+
+* gaps up to ``MAX_INTERPOLATED_GAP`` seconds are filled by linear interpolation,
+* longer gaps are kept on the grid as NaN, so rolling windows never bridge a stop or a sensor dropout,
+* ``time`` is the grid itself.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Longest gap between two samples, in seconds, that is filled by interpolation
+MAX_INTERPOLATED_GAP = 10
+
+
+def is_resampled(time: np.ndarray) -> bool:
+    """Whether a time stream is already the 1 Hz grid."""
+    return bool(np.all(np.diff(time) == 1))
+
+
+def _interpolate(grid: np.ndarray, time: np.ndarray, values: np.ndarray, max_gap: int) -> np.ndarray:
+    """Linear interpolation of samples onto the grid, NaN inside gaps longer than max_gap seconds."""
+    valid = ~np.isnan(values)
+    time, values = time[valid], values[valid]
+    if len(time) == 0:
+        return np.full(len(grid), np.nan)
+    stream = np.interp(grid, time, values, left=np.nan, right=np.nan)
+    previous = np.clip(np.searchsorted(time, grid, side="right") - 1, 0, len(time) - 1)
+    gap = time[np.minimum(previous + 1, len(time) - 1)] - time[previous]
+    stream[(grid != time[previous]) & (gap > max_gap)] = np.nan
+    return stream
+
+
+def resample_streams(df: pd.DataFrame, max_gap: int = MAX_INTERPOLATED_GAP) -> pd.DataFrame:
+    """Resample the streams of an activity onto a 1 Hz grid, activities without a time stream are left as they are.
+
+    Each stream is interpolated from its own samples, so a dropout of a single sensor longer than ``max_gap``
+    seconds stays NaN as well.
+    """
+    if "time" not in df.columns or df.empty:
+        return df
+    df = df[df["time"].notna()].drop_duplicates("time", keep="last").sort_values("time")
+    time = df["time"].to_numpy(dtype=np.int64)
+    if is_resampled(time):
+        return df.reset_index(drop=True)
+
+    grid = np.arange(time[0], time[-1] + 1)
+    resampled = {"time": grid}
+    for column in df.columns.drop("time"):
+        resampled[column] = _interpolate(grid, time, df[column].to_numpy(dtype=np.float64, na_value=np.nan), max_gap)
+    return pd.DataFrame(resampled)
+
+
+def get_recorded_time(df: pd.DataFrame) -> int:
+    """Seconds of a resampled activity with data, i.e. without the gaps left on the grid."""
+    streams = df.drop(columns="time", errors="ignore")
+    if streams.columns.empty:
+        return len(df)
+    return int(len(df) - streams.isna().all(axis=1).sum())
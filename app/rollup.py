@@ -0,0 +1,91 @@
+"""Materialized daily training totals of an athlete.
+
+``cache/<athlete_id>/daily_rollup.parquet`` holds one row per day with a cached ride: training stress, work, moving
+time, distance and ride count. It is built from the persisted activity metrics whenever rides are ingested, so the
+dashboard charts are resampled from it without touching stream data. Stress is stored in FTP-independent units,
+``NP^2 * duration / 36``, i.e. TSS times FTP squared.
+"""
+
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+from common import get_activity_store, get_tss_from_normalized_power
+from file_lock import unique_tmp_path
+from metrics import get_activity_metrics
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FILENAME = "daily_rollup.parquet"
+ROLLUP_COLUMNS = ["stress", "kilojoules", "moving_time", "distance", "rides"]
+
+
+def load_daily_rollup(cache_dir: Path, user_id: int) -> pd.DataFrame:
+    """Load the persisted daily totals of a user, indexed by Date."""
+    rollup_path = cache_dir / str(user_id) / ROLLUP_FILENAME
+    if not rollup_path.exists():
+        return pd.DataFrame(columns=ROLLUP_COLUMNS, index=pd.DatetimeIndex([], name="Date"), dtype="float64")
+    return pd.read_parquet(rollup_path)
+
+
+def update_daily_rollup(
+    cache_dir: Path, user_id: int, activity_id_to_df: Optional[Dict[int, pd.DataFrame]] = None
+) -> pd.DataFrame:
+    """Rebuild the daily totals from the metrics of every cached ride, persisting them if they changed.
+
+    Metrics are only computed for rides without current persisted ones, from ``activity_id_to_df`` when given.
+    """
+    store = get_activity_store(cache_dir, user_id)
+    # Held from reading the manifest to writing the rollup, so an older one never replaces a newer one
+    with store.lock:
+        manifest = store.load_manifest()
+        manifest = manifest[manifest["part"].notna() & manifest["start_date"].notna()]
+        metrics = get_activity_metrics(cache_dir, user_id, manifest.index.tolist(), activity_id_to_df)
+        # TSS at an FTP of 1 W, rides without power data have no normalized power and add no stress
+        stress = get_tss_from_normalized_power(metrics["normalized_power"], metrics["duration"], ftp=1.0)
+        activities = pd.DataFrame(
+            {
+                "stress": stress.fillna(0.0),
+                "kilojoules": metrics["kilojoules"],
+                "moving_time": metrics["moving_time"],
+                "distance": metrics["distance"],
+                "rides": 1,
+            }
+        ).astype("float64")
+        days = manifest.loc[metrics.index, "start_date"].dt.normalize().rename("Date")
+        rollup = activities.groupby(days.values).sum().rename_axis("Date")
+
+        if rollup.equals(load_daily_rollup(cache_dir, user_id)):
+            return rollup
+        rollup_path = cache_dir / str(user_id) / ROLLUP_FILENAME
+        tmp_path = unique_tmp_path(rollup_path)
+        rollup.to_parquet(tmp_path)
+        tmp_path.replace(rollup_path)
+        logger.info("Updated the daily rollup of %d rides over %d days for user %s", len(metrics), len(rollup), user_id)
+    return rollup
+
+
+def get_rollup(
+    rollup: pd.DataFrame, ftp: float, start_date: datetime, end_date: datetime, freq: str = "D"
+) -> pd.DataFrame:
+    """Training totals from start_date to end_date per period, e.g. ``"D"``, ``"W-MON"``, ``"MS"`` or ``"YS"``.
+
+    Periods are labeled with their first day, days without rides count as 0. Returns TSS for the given FTP, work in
+    kJ, moving time in hours, distance in km and the number of rides.
+    """
+    days = pd.date_range(
+        pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize(), freq="D", name="Date"
+    )
+    daily = rollup.reindex(days, fill_value=0.0)
+    totals = daily.resample(freq, label="left", closed="left").sum()
+    return pd.DataFrame(
+        {
+            "TSS": totals["stress"] / ftp**2,
+            "Work (kJ)": totals["kilojoules"],
+            "Moving Time (h)": totals["moving_time"] / 3600,
+            "Distance (km)": totals["distance"] / 1000,
+            "Rides": totals["rides"].astype(int),
+        }
+    )
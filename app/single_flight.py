@@ -0,0 +1,40 @@
+"""Single-flight coalescing of concurrent calls.
+
+Streamlit runs every session as a thread of the same process. When two sessions of the same athlete, or a rerun
+while a load is still running, ask for the same thing at once, only the first call runs and the others wait for and
+share its result.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """At most one call in flight per key, calls made while it runs get its result or exception."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Tuple[Any, bool]:
+        """Call ``fn`` unless a call for the key is in flight, returns the result and whether it was shared."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
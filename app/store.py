@@ -0,0 +1,413 @@
+"""Append-only columnar store of an athlete's activity streams.
+
+Layout of ``cache/<athlete_id>/``::
+
+    manifest.parquet            one row per activity: start date, sample count, columns, stream hash, part file,
+                                row group and the version of the stream format it is stored in
+    store/part-<uuid>.parquet   streams of many activities, one row group per activity
+
+Every append writes one new part file, so the number of files grows with the number of page loads that fetched new
+rides rather than with the number of rides, and ``compact`` folds them back into a single part.
+
+Streams are resampled onto a 1 Hz grid as they are appended, see ``resample.py``, and stored with the compact types
+of ``STREAM_SCHEMA``: whole watts and rpm as unsigned integers, distance and speed as float32. Activities stored in an
+older ``STREAMS_VERSION`` are converted by the next ``compact``.
+"""
+
+import hashlib
+import logging
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from file_lock import unique_tmp_path, user_lock
+from frame_cache import stream_cache
+from resample import resample_streams
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.parquet"
+STORE_DIRNAME = "store"
+# Compact the store into a single part file once it holds more part files than this
+MAX_PARTS = 16
+# 1: streams resampled to 1 Hz, 2: compact stream types
+STREAMS_VERSION = 2
+
+STREAM_SCHEMA = pa.schema(
+    [
+        ("time", pa.int32()),
+        ("distance", pa.float32()),
+        ("velocity_smooth", pa.float32()),
+        ("altitude", pa.float32()),
+        ("watts", pa.uint16()),
+        ("cadence", pa.uint8()),
+        ("heartrate", pa.uint8()),
+    ]
+)
+# Nullable pandas types of the integer streams, so gaps do not widen them to float64 in memory
+STREAM_DTYPES = {pa.uint16(): pd.UInt16Dtype(), pa.uint8(): pd.UInt8Dtype()}
+# Time is a run of consecutive seconds, floats compress better with their bytes split into streams
+COLUMN_ENCODING = {
+    "time": "DELTA_BINARY_PACKED",
+    "distance": "BYTE_STREAM_SPLIT",
+    "velocity_smooth": "BYTE_STREAM_SPLIT",
+    "altitude": "BYTE_STREAM_SPLIT",
+}
+COMPRESSION = "zstd"
+
+
+def _naive_timestamp(date: Optional[datetime]) -> pd.Timestamp:
+    """Local wall-clock time, comparable with the naive datetimes the dashboard uses."""
+    if date is None:
+        return pd.NaT
+    return pd.Timestamp(date).replace(tzinfo=None)
+
+
+def _empty_manifest() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "start_date": pd.Series(dtype="datetime64[ns]"),
+            "num_samples": pd.Series(dtype="int64"),
+            "columns": pd.Series(dtype="object"),
+            "stream_hash": pd.Series(dtype="object"),
+            "part": pd.Series(dtype="object"),
+            "row_group": pd.Series(dtype="int64"),
+            "version": pd.Series(dtype="int64"),
+        },
+        index=pd.Index([], dtype="int64", name="activity_id"),
+    )
+
+
+def _stream_columns(schema: pa.Schema) -> List[str]:
+    return [name for name in schema.names if not name.startswith("__index_level_")]
+
+
+def _split_columns(columns: str) -> List[str]:
+    return [column for column in columns.split(",") if column]
+
+
+def stream_hash(table: pa.Table, columns: List[str]) -> str:
+    """Content hash of an activity's streams, independent of the integer or float type they are stored with."""
+    digest = hashlib.sha1()
+    for column in sorted(columns):
+        digest.update(column.encode())
+        digest.update(table.column(column).to_numpy().astype("float64").tobytes())
+    return digest.hexdigest()
+
+
+def _stream_field(field: pa.Field) -> pa.Field:
+    """Stored type of a stream, streams without a compact type are interpolated into floats."""
+    if field.name in STREAM_SCHEMA.names:
+        return STREAM_SCHEMA.field(field.name)
+    return field.with_type(pa.float64())
+
+
+def to_stream_table(df: pd.DataFrame) -> pa.Table:
+    """Resample the streams of an activity to 1 Hz and convert them to their stored types."""
+    df = resample_streams(df)
+    arrays, fields = [], []
+    for column in df.columns:
+        field = _stream_field(pa.field(column, pa.float64()))
+        values = df[column].to_numpy(dtype="float64", na_value=np.nan)
+        missing = np.isnan(values)
+        if pa.types.is_integer(field.type):
+            info = np.iinfo(field.type.to_pandas_dtype())
+            values = np.clip(np.round(np.where(missing, 0, values)), info.min, info.max)
+        arrays.append(pa.array(values, mask=missing if missing.any() else None).cast(field.type))
+        fields.append(field)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def to_stream_frame(table: pa.Table) -> pd.DataFrame:
+    """DataFrame of stored streams, keeping their compact types."""
+    return table.to_pandas(types_mapper=STREAM_DTYPES.get)
+
+
+def compact_streams(df: pd.DataFrame) -> pd.DataFrame:
+    """Streams of an activity as they are stored, e.g. to keep freshly fetched activities compact in memory."""
+    return to_stream_frame(to_stream_table(df))
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Cast a table to the part schema, filling the columns it does not have with nulls."""
+    arrays = [
+        (
+            table.column(field.name).cast(field.type)
+            if field.name in table.column_names
+            else pa.nulls(table.num_rows, field.type)
+        )
+        for field in schema
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class ActivityStore:
+    """Per-athlete activity streams in a handful of Parquet files, indexed by the manifest."""
+
+    def __init__(self, cache_dir: Path, user_id: int):
+        self.user_cache_dir = cache_dir / str(user_id)
+        self.store_dir = self.user_cache_dir / STORE_DIRNAME
+        self.manifest_path = self.user_cache_dir / MANIFEST_FILENAME
+        # Held by the manifest read-modify-writes and compactions of every thread and process
+        self.lock = user_lock(self.user_cache_dir)
+
+    def load_manifest(self) -> pd.DataFrame:
+        """Load the manifest, indexed by activity ID."""
+        if not self.manifest_path.exists():
+            return _empty_manifest()
+        manifest = pd.read_parquet(self.manifest_path)
+        if "part" not in manifest.columns:
+            # Manifest of the one-file-per-activity cache, only its start dates are still useful
+            manifest = pd.concat([_empty_manifest(), manifest[["start_date"]]])
+        manifest = manifest.reindex(columns=_empty_manifest().columns)
+        # Activities stored before the stream format was versioned
+        manifest["version"] = manifest["version"].fillna(0).astype("int64")
+        return manifest
+
+    def _save_manifest(self, manifest: pd.DataFrame):
+        tmp_path = unique_tmp_path(self.manifest_path)
+        manifest.sort_values("start_date").to_parquet(tmp_path)
+        tmp_path.replace(self.manifest_path)
+
+    def activity_ids(self) -> Set[int]:
+        """IDs of the activities held by the store."""
+        manifest = self.load_manifest()
+        return set(manifest.index[manifest["part"].notna()])
+
+    def select(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[int]:
+        """IDs of the stored activities that started within the date range, activities without a date are skipped."""
+        manifest = self.load_manifest()
+        in_range = manifest["part"].notna()
+        if start_date is not None:
+            in_range &= manifest["start_date"] >= _naive_timestamp(start_date)
+        if end_date is not None:
+            in_range &= manifest["start_date"] <= _naive_timestamp(end_date)
+        return manifest.index[in_range].tolist()
+
+    def set_start_dates(self, activity_id_to_date: Dict[int, datetime]):
+        """Fill in the start dates of stored activities that were imported without one."""
+        with self.lock:
+            manifest = self.load_manifest()
+            activity_ids = [
+                activity_id
+                for activity_id in activity_id_to_date
+                if activity_id in manifest.index and pd.isna(manifest.at[activity_id, "start_date"])
+            ]
+            if not activity_ids:
+                return
+            logger.info("Setting the start date of %d activities @ %s", len(activity_ids), self.manifest_path)
+            manifest.loc[activity_ids, "start_date"] = [
+                _naive_timestamp(activity_id_to_date[activity_id]) for activity_id in activity_ids
+            ]
+            self._save_manifest(manifest)
+
+    def _write_part(
+        self, schema: pa.Schema, activity_tables: Iterable[Tuple[int, pa.Table, List[str]]]
+    ) -> pd.DataFrame:
+        """Write ``(activity_id, table, columns)`` triples to a new part file, one row group per non-empty activity.
+
+        Returns the manifest entries of the written activities without their start dates.
+        """
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        part = f"part-{uuid.uuid4().hex}.parquet"
+        # Written under a temporary name so a part file is either complete or absent
+        tmp_path = unique_tmp_path(self.store_dir / part)
+        entries = []
+        writer = None
+        row_group = 0
+        try:
+            for activity_id, table, columns in activity_tables:
+                entry = {
+                    "activity_id": activity_id,
+                    "num_samples": table.num_rows,
+                    "columns": ",".join(columns),
+                    "stream_hash": stream_hash(table, columns),
+                }
+                if table.num_rows > 0:
+                    if writer is None:
+                        column_encoding = {
+                            name: COLUMN_ENCODING[name] for name in schema.names if name in COLUMN_ENCODING
+                        }
+                        writer = pq.ParquetWriter(
+                            tmp_path,
+                            schema,
+                            compression=COMPRESSION,
+                            use_dictionary=[name for name in schema.names if name not in column_encoding],
+                            column_encoding=column_encoding,
+                        )
+                    writer.write_table(_conform(table, schema), row_group_size=table.num_rows)
+                    entry.update(part=part, row_group=row_group)
+                    row_group += 1
+                else:
+                    # Nothing to store, recorded so the activity is not fetched again
+                    entry.update(part="", row_group=-1)
+                entries.append(entry)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                tmp_path.unlink(missing_ok=True)
+            raise
+        if writer is not None:
+            writer.close()
+            tmp_path.replace(self.store_dir / part)
+        logger.info("Wrote %d activities to %s", len(entries), self.store_dir / part)
+        return pd.DataFrame(entries).set_index("activity_id")
+
+    def _parts(self) -> List[Path]:
+        return sorted(self.store_dir.glob("part-*.parquet"))
+
+    def append(self, activity_id_to_df: Dict[int, pd.DataFrame], activity_id_to_date: Dict[int, datetime]):
+        """Append activities to the store in a single new part file, replacing earlier copies of them."""
+        if not activity_id_to_df:
+            return
+        tables = {activity_id: to_stream_table(df) for activity_id, df in activity_id_to_df.items()}
+        schema = pa.unify_schemas([table.schema for table in tables.values()], promote_options="permissive")
+        with self.lock:
+            entries = self._write_part(
+                schema, ((activity_id, table, table.column_names) for activity_id, table in tables.items())
+            )
+            entries["start_date"] = [_naive_timestamp(activity_id_to_date.get(activity_id)) for activity_id in tables]
+            entries["version"] = STREAMS_VERSION
+            manifest = self.load_manifest()
+            manifest = pd.concat([manifest.drop(index=entries.index, errors="ignore"), entries])
+            self._save_manifest(manifest)
+            if len(self._parts()) > MAX_PARTS:
+                self.compact()
+
+    def _cache_key(
+        self, activity_id: int, entry: pd.Series, columns: Optional[Tuple[str, ...]]
+    ) -> Tuple[str, int, str, Optional[Tuple[str, ...]]]:
+        return str(self.user_cache_dir), activity_id, entry["stream_hash"], columns
+
+    def read(self, activity_ids: Iterable[int], columns: Optional[List[str]] = None) -> Dict[int, pd.DataFrame]:
+        """Read activities through the process-wide stream cache, with one ``read_row_groups`` call per part file.
+
+        ``columns`` restricts the streams read and returned, columns an activity does not have are left out of its
+        DataFrame. Frames are cached per column set, so a projection is never served from or read as a full ride.
+        """
+        activity_ids = list(activity_ids)
+        try:
+            return self._read(self.load_manifest(), activity_ids, columns)
+        except FileNotFoundError:
+            # A compaction replaced the part files after the manifest was loaded, read again while holding it off
+            with self.lock:
+                return self._read(self.load_manifest(), activity_ids, columns)
+
+    def _read(
+        self, manifest: pd.DataFrame, activity_ids: List[int], columns: Optional[List[str]]
+    ) -> Dict[int, pd.DataFrame]:
+        entries = manifest.loc[[activity_id for activity_id in activity_ids if activity_id in manifest.index]]
+        entries = entries[entries["part"].notna()]
+        activity_id_to_df = {activity_id: pd.DataFrame() for activity_id in entries.index[entries["num_samples"] == 0]}
+        key_columns = None if columns is None else tuple(columns)
+        missing = []
+        for activity_id, entry in entries[entries["num_samples"] > 0].iterrows():
+            df = stream_cache.get(self._cache_key(activity_id, entry, key_columns))
+            if df is None:
+                missing.append(activity_id)
+            else:
+                activity_id_to_df[activity_id] = df
+        for part, part_entries in entries.loc[missing].groupby("part"):
+            parquet_file = pq.ParquetFile(self.store_dir / part)
+            part_columns = _stream_columns(parquet_file.schema_arrow)
+            if columns is not None:
+                part_columns = [column for column in columns if column in part_columns]
+            row_groups = part_entries["row_group"].astype(int).tolist()
+            table = parquet_file.read_row_groups(row_groups, columns=part_columns)
+            offset = 0
+            for activity_id, entry in part_entries.iterrows():
+                activity_columns = _split_columns(entry["columns"])
+                num_samples = int(entry["num_samples"])
+                activity_table = table.slice(offset, num_samples).select(
+                    [column for column in part_columns if column in activity_columns]
+                )
+                activity_id_to_df[activity_id] = to_stream_frame(activity_table)
+                stream_cache.put(self._cache_key(activity_id, entry, key_columns), activity_id_to_df[activity_id])
+                offset += num_samples
+        if missing:
+            logger.info("Read %d of %d activities from %s", len(missing), len(entries), self.store_dir)
+        return activity_id_to_df
+
+    def _iter_stored_tables(self, manifest: pd.DataFrame) -> Iterator[Tuple[int, pa.Table, List[str]]]:
+        parquet_files = {}
+        for activity_id, entry in manifest.iterrows():
+            if entry["num_samples"] == 0:
+                yield activity_id, pa.table({}), []
+                continue
+            if entry["part"] not in parquet_files:
+                parquet_files[entry["part"]] = pq.ParquetFile(self.store_dir / entry["part"])
+            columns = _split_columns(entry["columns"])
+            table = parquet_files[entry["part"]].read_row_group(int(entry["row_group"]), columns=columns)
+            if entry["version"] < STREAMS_VERSION:
+                table = to_stream_table(to_stream_frame(table))
+            yield activity_id, table, table.column_names
+
+    def _iter_legacy_tables(
+        self, files: Dict[int, Path], schemas: Dict[int, pa.Schema]
+    ) -> Iterator[Tuple[int, pa.Table, List[str]]]:
+        for activity_id, file in files.items():
+            table = to_stream_table(pq.read_table(file, columns=_stream_columns(schemas[activity_id])).to_pandas())
+            yield activity_id, table, table.column_names
+
+    def compact(self):
+        """Rewrite every stored activity into a single part file, one row group at a time, and drop the old parts.
+
+        Activities stored in an older stream format are converted on the way.
+        """
+        with self.lock:
+            old_parts = self._parts()
+            manifest = self.load_manifest()
+            manifest = manifest[manifest["part"].notna()]
+            schema = pa.unify_schemas(
+                [pq.read_schema(part).remove_metadata() for part in old_parts], promote_options="permissive"
+            )
+            schema = pa.schema([_stream_field(field) for field in schema if field.name in _stream_columns(schema)])
+            entries = self._write_part(schema, self._iter_stored_tables(manifest))
+            entries["start_date"] = manifest["start_date"]
+            entries["version"] = STREAMS_VERSION
+            self._save_manifest(entries)
+            for part in old_parts:
+                part.unlink()
+            logger.info("Compacted %d part files @ %s", len(old_parts), self.store_dir)
+
+    def migrate(self):
+        """Import the legacy ``<activity_id>.parquet`` files of the user's cache directory into the store."""
+        legacy_files = {int(file.stem): file for file in self.user_cache_dir.glob("*.parquet") if file.stem.isdigit()}
+        if not legacy_files:
+            return
+        with self.lock:
+            manifest = self.load_manifest()
+            stored = manifest.index[manifest["part"].notna()]
+            new_files = {activity_id: file for activity_id, file in legacy_files.items() if activity_id not in stored}
+            if new_files:
+                schemas = {activity_id: pq.read_schema(file) for activity_id, file in new_files.items()}
+                schema = pa.unify_schemas(
+                    [
+                        pa.schema([_stream_field(schema.field(name)) for name in _stream_columns(schema)])
+                        for schema in schemas.values()
+                    ],
+                    promote_options="permissive",
+                )
+                entries = self._write_part(schema, self._iter_legacy_tables(new_files, schemas))
+                entries["start_date"] = manifest["start_date"].reindex(entries.index)
+                entries["version"] = STREAMS_VERSION
+                manifest = pd.concat([manifest.drop(index=entries.index, errors="ignore"), entries])
+                self._save_manifest(manifest)
+            for file in legacy_files.values():
+                # Another process may have migrated them first
+                file.unlink(missing_ok=True)
+            logger.info("Migrated %d cached activities into %s", len(new_files), self.store_dir)
+
+    def upgrade(self):
+        """Convert the activities stored in an older stream format by compacting the store."""
+        with self.lock:
+            manifest = self.load_manifest()
+            outdated = manifest["part"].notna() & (manifest["version"] < STREAMS_VERSION)
+            if outdated.any():
+                logger.info("Upgrading %d stored activities @ %s", outdated.sum(), self.store_dir)
+                self.compact()
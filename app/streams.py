@@ -0,0 +1,88 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import stravalib.client
+from common import save_cached_data
+from single_flight import SingleFlight
+from store import compact_streams
+
+logger = logging.getLogger(__name__)
+
+STREAM_TYPES = ["time", "distance", "velocity_smooth", "watts", "cadence"]
+
+# requests' default connection pool holds 10 connections per host, stay below it
+DEFAULT_MAX_WORKERS = 8
+
+# Sessions of the same athlete share the stream requests in flight
+_stream_flights = SingleFlight()
+
+
+def fetch_activity_df(
+    client: stravalib.client.Client, activity_id: int, stream_types: List[str] = STREAM_TYPES
+) -> pd.DataFrame:
+    """Fetch the streams of a single activity as a DataFrame resampled to 1 Hz and in their stored types."""
+    activity_stream = client.get_activity_streams(activity_id, types=stream_types)
+    return compact_streams(
+        pd.DataFrame(
+            {stream_type: stream.data for stream_type, stream in activity_stream.items() if stream is not None}
+        )
+    )
+
+
+def _fetch_shared_activity_df(
+    client: stravalib.client.Client, user_id: int, activity_id: int, stream_types: List[str]
+) -> Tuple[pd.DataFrame, bool]:
+    return _stream_flights.do((user_id, activity_id), fetch_activity_df, client, activity_id, stream_types)
+
+
+def fetch_activity_dfs(
+    client: stravalib.client.Client,
+    activity_id_to_date: Dict[int, datetime],
+    cache_dir: Path,
+    user_id: int,
+    stream_types: List[str] = STREAM_TYPES,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> Dict[int, pd.DataFrame]:
+    """Fetch the streams of many activities with a bounded thread pool.
+
+    The workers only do network I/O. Once every request has completed, or one of them failed, the fetched DataFrames
+    are appended to the user's activity store in one batch. ``max_workers=1`` falls back to fetching serially.
+    Activities already being fetched by another session are waited for instead of fetched again, and only stored by
+    the session that fetched them.
+    """
+    activity_id_to_df, fetched_ids = {}, []
+    try:
+        if max_workers <= 1:
+            for activity_id in activity_id_to_date:
+                activity_id_to_df[activity_id], shared = _fetch_shared_activity_df(
+                    client, user_id, activity_id, stream_types
+                )
+                if not shared:
+                    fetched_ids.append(activity_id)
+            return activity_id_to_df
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="strava-streams") as executor:
+            futures = {
+                executor.submit(_fetch_shared_activity_df, client, user_id, activity_id, stream_types): activity_id
+                for activity_id in activity_id_to_date
+            }
+            for future in as_completed(futures):
+                activity_id = futures[future]
+                activity_id_to_df[activity_id], shared = future.result()
+                if not shared:
+                    fetched_ids.append(activity_id)
+                logger.info(
+                    "%s streams of activity %s for user %s.", "Shared" if shared else "Fetched", activity_id, user_id
+                )
+        return activity_id_to_df
+    finally:
+        save_cached_data(
+            cache_dir,
+            user_id,
+            {activity_id: activity_id_to_df[activity_id] for activity_id in fetched_ids},
+            activity_id_to_date,
+        )
@@ -0,0 +1,130 @@
+"""Summary metrics of a ride computed straight from its 1 Hz sample arrays."""
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+# Samples averaged by the rolling window of normalized power
+NORMALIZED_POWER_WINDOW = 30
+# Elevation changes between consecutive samples at least this big are treated as GPS spikes
+ELEVATION_SPIKE_THRESHOLD = 10.0
+
+
+@dataclass(frozen=True)
+class RideSummary:
+    """Summary metrics of a ride, NaN where the stream they are computed from is missing."""
+
+    num_samples: int
+    moving_time: int
+    distance: float
+    average_speed: float
+    max_speed: float
+    max_elevation: float
+    min_elevation: float
+    elevation_gain: float
+    cadence_samples: int
+    average_cadence: float
+    max_cadence: float
+    power_samples: int
+    average_power: float
+    max_power: float
+    kilojoules: float
+    normalized_power: float
+
+    def intensity_factor(self, ftp: float) -> float:
+        return self.normalized_power / ftp
+
+    def tss(self, ftp: float) -> float:
+        """Training stress score over the moving time."""
+        return self.intensity_factor(ftp) ** 2 * self.moving_time / 3600 * 100
+
+
+def _as_array(values: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    return None if values is None else np.asarray(values, dtype=np.float64)
+
+
+def _reduce(values: Optional[np.ndarray], func) -> float:
+    """Reduction of the non-missing samples, NaN without any."""
+    if values is None:
+        return np.nan
+    values = values[~np.isnan(values)]
+    return float(func(values)) if len(values) else np.nan
+
+
+def get_normalized_power(power: np.ndarray, window: int = NORMALIZED_POWER_WINDOW) -> float:
+    """Fourth-power mean of the rolling average power, windows with a missing sample are left out.
+
+    Every window average is a difference of the cumulative sum, so the rolling mean is a single O(n) pass.
+    """
+    if len(power) < window:
+        return np.nan
+    missing = np.isnan(power)
+    cumsum = np.zeros(len(power) + 1)
+    np.cumsum(np.where(missing, 0.0, power), out=cumsum[1:])
+    missing_cumsum = np.zeros(len(power) + 1, dtype=np.int64)
+    np.cumsum(missing, out=missing_cumsum[1:])
+    complete = missing_cumsum[window:] == missing_cumsum[:-window]
+    if not complete.any():
+        return np.nan
+    rolling_mean = (cumsum[window:] - cumsum[:-window])[complete] / window
+    return float(np.mean(rolling_mean**4) ** 0.25)
+
+
+def get_ride_summary(
+    power: Optional[np.ndarray] = None,
+    speed: Optional[np.ndarray] = None,
+    cadence: Optional[np.ndarray] = None,
+    elevation: Optional[np.ndarray] = None,
+    distance: Optional[np.ndarray] = None,
+    num_samples: Optional[int] = None,
+) -> RideSummary:
+    """Summary of a ride recorded at 1 Hz from its sample arrays, any of which may be left out.
+
+    Without a speed stream every sample counts as moving. Elevation gain sums the climbs between consecutive samples,
+    ignoring spikes of ``ELEVATION_SPIKE_THRESHOLD`` or more. Cadence is averaged over the pedalling samples only.
+    """
+    power, speed, cadence, elevation, distance = map(_as_array, (power, speed, cadence, elevation, distance))
+    if num_samples is None:
+        num_samples = next(
+            (len(values) for values in (power, speed, cadence, elevation, distance) if values is not None), 0
+        )
+
+    moving_time = num_samples if speed is None else int(np.count_nonzero(speed > 0))
+
+    elevation_gain = np.nan
+    if elevation is not None:
+        climbs = np.diff(elevation)
+        elevation_gain = float(climbs[(climbs > 0) & (climbs < ELEVATION_SPIKE_THRESHOLD)].sum())
+
+    cadence_samples, average_cadence = 0, np.nan
+    if cadence is not None:
+        cadence_samples = int(np.count_nonzero(~np.isnan(cadence)))
+        pedalling = cadence[cadence > 0]
+        average_cadence = float(pedalling.mean()) if len(pedalling) else np.nan
+
+    power_samples, average_power, kilojoules, normalized_power = 0, np.nan, 0.0, np.nan
+    if power is not None:
+        power_samples = int(np.count_nonzero(~np.isnan(power)))
+        kilojoules = float(np.nansum(power)) / 1000
+        average_power = kilojoules * 1000 / power_samples if power_samples else np.nan
+        normalized_power = get_normalized_power(power)
+
+    return RideSummary(
+        num_samples=num_samples,
+        moving_time=moving_time,
+        distance=_reduce(distance, np.max),
+        average_speed=_reduce(speed, np.mean),
+        max_speed=_reduce(speed, np.max),
+        max_elevation=_reduce(elevation, np.max),
+        min_elevation=_reduce(elevation, np.min),
+        elevation_gain=elevation_gain,
+        cadence_samples=cadence_samples,
+        average_cadence=average_cadence,
+        max_cadence=_reduce(cadence, np.max),
+        power_samples=power_samples,
+        average_power=average_power,
+        max_power=_reduce(power, np.max),
+        kilojoules=kilojoules,
+        normalized_power=normalized_power,
+    )
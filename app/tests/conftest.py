@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests import the dashboard modules the way app.py does
+sys.path.append(str(Path(__file__).resolve().parents[1]))
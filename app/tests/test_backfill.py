@@ -0,0 +1,31 @@
+import backfill
+import pandas as pd
+import pytest
+
+
+class FailingStore:
+    def __init__(self):
+        self.appended = []
+
+    def append(self, activity_id_to_df, activity_id_to_date):
+        if not activity_id_to_df:
+            return
+        self.appended.append(sorted(activity_id_to_df))
+        raise OSError("No space left on device")
+
+
+def test_failed_append_raises_only_its_own_error(tmp_path, monkeypatch):
+    store = FailingStore()
+    monkeypatch.setattr(backfill, "get_activity_store", lambda cache_dir, athlete_id: store)
+    monkeypatch.setattr(backfill, "fetch_activity_df", lambda client, activity_id: pd.DataFrame({"time": [0, 1]}))
+    pending = [(200, 2, "2025-05-02T08:00:00"), (100, 1, "2025-05-01T08:00:00")]
+    checkpoint = backfill.Checkpoint(tmp_path / backfill.CHECKPOINT_FILENAME, listing_done=True, pending=list(pending))
+
+    with pytest.raises(OSError, match="No space left") as excinfo:
+        backfill.download_streams(None, backfill.RequestBudget(), checkpoint, tmp_path, 1)
+
+    # The batch is appended once and the error is not chained to a second append of it
+    assert store.appended == [[1, 2]]
+    assert excinfo.value.__context__ is None
+    assert checkpoint.pending == pending
+    assert not checkpoint.path.exists()
@@ -0,0 +1,97 @@
+"""Persisted daily Performance Management Chart state of an athlete.
+
+``cache/<athlete_id>/training_load.parquet`` holds one row per day from the athlete's first cached ride to today with
+the day's training stress and the CTL and ATL at the end of it. The values are in FTP-independent stress units,
+``NP^2 * duration / 36``, i.e. TSS times FTP squared. CTL and ATL are linear in TSS, so the chart for any FTP is the
+stored state divided by FTP squared, and an FTP change never recomputes it.
+"""
+
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from file_lock import unique_tmp_path, user_lock
+from pmc import get_pmc
+
+logger = logging.getLogger(__name__)
+
+TRAINING_LOAD_FILENAME = "training_load.parquet"
+CTL_DAYS = 42
+ATL_DAYS = 7
+
+
+def load_training_load_state(cache_dir: Path, user_id: int) -> pd.DataFrame:
+    """Load the persisted daily stress, CTL and ATL of a user, indexed by Date."""
+    state_path = cache_dir / str(user_id) / TRAINING_LOAD_FILENAME
+    if not state_path.exists():
+        return pd.DataFrame(
+            {"stress": [], "ctl": [], "atl": []}, index=pd.DatetimeIndex([], name="Date"), dtype="float64"
+        )
+    return pd.read_parquet(state_path)
+
+
+def update_training_load_state(
+    cache_dir: Path, user_id: int, daily_stress: pd.Series, today: Optional[datetime] = None
+) -> pd.DataFrame:
+    """Bring the persisted state up to date with the daily stress of the rollup and extend it to today.
+
+    Only the days from the first one whose stress changed, e.g. the day of a newly cached ride, are recomputed,
+    starting from the stored CTL and ATL of the day before.
+    """
+    if daily_stress.empty:
+        return load_training_load_state(cache_dir, user_id)
+    today = pd.Timestamp(today or datetime.today()).normalize()
+    days = pd.date_range(daily_stress.index.min(), max(today, daily_stress.index.max()), freq="D", name="Date")
+    daily_stress = daily_stress.reindex(days, fill_value=0.0)
+
+    with user_lock(cache_dir / str(user_id)):
+        state = load_training_load_state(cache_dir, user_id)
+        if state.empty or state.index[0] != days[0]:
+            first_changed = 0
+        else:
+            stored_stress = state["stress"].reindex(days)
+            changed = stored_stress.isna().to_numpy() | ~np.isclose(stored_stress.to_numpy(), daily_stress.to_numpy())
+            if not changed.any():
+                return state
+            first_changed = int(changed.argmax())
+
+        initial_ctl, initial_atl = (
+            (0.0, 0.0) if first_changed == 0 else state.loc[days[first_changed - 1], ["ctl", "atl"]]
+        )
+        ctl, atl, _ = get_pmc(daily_stress.to_numpy()[first_changed:], CTL_DAYS, ATL_DAYS, initial_ctl, initial_atl)
+        updated = pd.DataFrame(
+            {"stress": daily_stress.to_numpy()[first_changed:], "ctl": ctl, "atl": atl}, index=days[first_changed:]
+        )
+        state = pd.concat([state.loc[: days[first_changed] - pd.Timedelta(days=1)], updated])
+        logger.info(
+            "Updated %d days of training load state for user %s from %s",
+            len(updated),
+            user_id,
+            days[first_changed].date(),
+        )
+        state_path = cache_dir / str(user_id) / TRAINING_LOAD_FILENAME
+        tmp_path = unique_tmp_path(state_path)
+        state.to_parquet(tmp_path)
+        tmp_path.replace(state_path)
+    return state
+
+
+def get_training_load_window(state: pd.DataFrame, ftp: float, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    """CTL, ATL and TSB of the stored state for an FTP over a date range, indexed by Date.
+
+    Days before the first cached ride have no training load, days after the last stored one decay without stress.
+    """
+    days = pd.date_range(
+        pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize(), freq="D", name="Date"
+    )
+    window = state[["ctl", "atl"]].reindex(days)
+    if not state.empty:
+        elapsed = (days - state.index[-1]).days.to_numpy()
+        after = elapsed > 0
+        window.loc[after, "ctl"] = state["ctl"].iloc[-1] * (1 - 2 / (CTL_DAYS + 1)) ** elapsed[after]
+        window.loc[after, "atl"] = state["atl"].iloc[-1] * (1 - 2 / (ATL_DAYS + 1)) ** elapsed[after]
+    window = window.fillna(0.0) / ftp**2
+    return pd.DataFrame({"CTL": window["ctl"], "ATL": window["atl"], "TSB": window["ctl"] - window["atl"]})
@@ -0,0 +1,32 @@
+"""Time-to-live cache of function results, e.g. Strava API responses kept for the lifetime of a Streamlit session."""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class TTLCache:
+    """Results keyed by tuples, recomputed once older than the TTL they were cached with."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[Hashable, ...], Tuple[Any, float]] = {}
+
+    def get(self, key: Tuple[Hashable, ...], fn: Callable[[], Any], ttl: float) -> Any:
+        """Cached result of the key, or the result of calling ``fn`` once it is missing or expired."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        value = fn()
+        with self._lock:
+            self._entries[key] = (value, now + ttl)
+        return value
+
+    def invalidate(self, *prefix: Hashable):
+        """Drop the entries whose key starts with the prefix, every entry without one."""
+        with self._lock:
+            for key in [key for key in self._entries if key[: len(prefix)] == prefix]:
+                del self._entries[key]
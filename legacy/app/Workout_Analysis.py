@@ -1,11 +1,21 @@
 import re
+import sys
 from datetime import timedelta
+from pathlib import Path
 
 import altair as alt
+import numpy as np
 import ollama
 import pandas as pd
 import streamlit as st
-from common import ZONE_COLORS, ZONES, Colors, get_tcx_data, get_zone, tcx_to_df
+
+# The ride summary and mean-max power kernels are shared with the dashboard
+sys.path.append(str(Path(__file__).resolve().parents[2] / "app"))
+from common import Colors  # noqa: E402
+from mean_max import get_mean_max_power, get_power_curve_durations  # noqa: E402
+from summary import get_ride_summary  # noqa: E402
+from tcx import read_tcx  # noqa: E402
+from zones import POWER_ZONES  # noqa: E402
 
 # Custom model built with Ollama Modelfile
 LLM = "cycling-qwen2.5:7b"
@@ -17,13 +27,6 @@ def set_colors(value: str, color: str = None) -> str:
     return f":{color}[{value}]"
 
 
-def get_zone_range(zone: int, ftp: float) -> str:
-    zones_upper_thresh = [0, 0.55, 0.75, 0.9, 1.05, 1.2, 1.5]
-    if zone < len(zones_upper_thresh) - 1:
-        return f"{ftp * zones_upper_thresh[zone]:.0f} - {ftp * zones_upper_thresh[zone + 1]:.0f} W"
-    return f"{ftp * zones_upper_thresh[zone]:.0f}+ W"
-
-
 def model_res_generator():
     messages = (
         st.session_state["summary"] + st.session_state["messages"]
@@ -69,32 +72,35 @@ st.divider()
 if uploaded_file is not None:
     # ----------------- SUMMARY -----------------
     st.header("Workout Summary")
-    tcx_data = get_tcx_data(uploaded_file)
-    df = tcx_to_df(tcx_data, kph=True)
-    df["zone"] = df["power"].apply(lambda x: get_zone(x, ftp))
+    df = read_tcx(uploaded_file, speed_unit="kph")
 
     st.map(df, latitude="latitude", longitude="longitude", size=1, use_container_width=True)
 
-    moving_time_seconds = df[df["speed"] > 0].shape[0]
-    power_avg = df["power"].mean()
-    calories = power_avg * moving_time_seconds / 1000
+    summary = get_ride_summary(
+        power=df["power"].to_numpy(),
+        speed=df["speed"].to_numpy(),
+        cadence=df["cadence"].to_numpy(),
+        elevation=df["elevation"].to_numpy(),
+        distance=df["distance"].to_numpy(),
+    )
+    calories = summary.average_power * summary.moving_time / 1000
 
     col1, col2, col3 = st.columns(3)
-    col1.metric("Distance", f"{tcx_data.distance / 1000:.2f} km")
-    col2.metric("Duration", f"{timedelta(seconds=tcx_data.duration)}")
-    col3.metric("Moving Time", f"{timedelta(seconds=moving_time_seconds)}")
+    col1.metric("Distance", f"{summary.distance / 1000:.2f} km")
+    col2.metric("Duration", f"{timedelta(seconds=(df.index[-1] - df.index[0]).total_seconds())}")
+    col3.metric("Moving Time", f"{timedelta(seconds=summary.moving_time)}")
 
     col1, col2, col3 = st.columns(3)
-    col1.metric("Average Speed", f"{df['speed'].mean():.2f} km/h")
+    col1.metric("Average Speed", f"{summary.average_speed:.2f} km/h")
     col2.metric("Calories", f"{calories:.0f} kcal")
-    col3.metric("Average Power", f"{power_avg:.0f} W")
+    col3.metric("Average Power", f"{summary.average_power:.0f} W")
 
     st.divider()
 
     # ----------------- SPEED -----------------
     st.header("Speed")
     df["distance"] = df["distance"] / 1000
-    df["elevation_scaled"] = df["elevation"] * (df["speed"].max() / df["elevation"].max())
+    df["elevation_scaled"] = df["elevation"] * (summary.max_speed / summary.max_elevation)
     st.area_chart(
         df,
         x="distance",
@@ -106,8 +112,8 @@ if uploaded_file is not None:
     )
 
     col1, col2 = st.columns(2)
-    col1.metric("Average Speed", f"{df['speed'].mean():.2f} km/h")
-    col2.metric("Max Speed", f"{df['speed'].max():.2f} km/h")
+    col1.metric("Average Speed", f"{summary.average_speed:.2f} km/h")
+    col2.metric("Max Speed", f"{summary.max_speed:.2f} km/h")
 
     st.divider()
 
@@ -122,18 +128,16 @@ if uploaded_file is not None:
         color=Colors.DARK_ORANGE,
     )
     col1, col2, col3 = st.columns(3)
-    col1.metric("Max Elevation", f"{df['elevation'].max():.0f} m")
-    col2.metric("Min Elevation", f"{df['elevation'].min():.0f} m")
-    diff = df["elevation"].diff().clip(lower=0)
-    elevation_gain = diff[diff < 10].sum()  # Ignore very big elevation changes
-    col3.metric("Elevation Gain", f"{elevation_gain:.0f} m")
+    col1.metric("Max Elevation", f"{summary.max_elevation:.0f} m")
+    col2.metric("Min Elevation", f"{summary.min_elevation:.0f} m")
+    col3.metric("Elevation Gain", f"{summary.elevation_gain:.0f} m")
 
     st.divider()
 
     # ----------------- CADENCE -----------------
-    if df["cadence"].notna().sum() > len(df) / 2:
+    if summary.cadence_samples > summary.num_samples / 2:
         st.header("Cadence")
-        df["elevation_scaled"] = df["elevation"] * (df["cadence"].max() / df["elevation"].max())
+        df["elevation_scaled"] = df["elevation"] * (summary.max_cadence / summary.max_elevation)
         st.area_chart(
             df,
             x="distance",
@@ -145,25 +149,23 @@ if uploaded_file is not None:
         )
 
         col1, col2 = st.columns(2)
-        avg_cadence = df[df["cadence"] > 0]["cadence"].mean()
-        col1.metric("Average Cadence", f"{avg_cadence:.0f} rpm")
-        col2.metric("Max Cadence", f"{df['cadence'].max():.0f} rpm")
+        col1.metric("Average Cadence", f"{summary.average_cadence:.0f} rpm")
+        col2.metric("Max Cadence", f"{summary.max_cadence:.0f} rpm")
 
         st.divider()
 
     # ----------------- POWER -----------------
-    if df["power"].notna().sum() > len(df) / 2:
+    if summary.power_samples > summary.num_samples / 2:
         st.header("Power")
         st.area_chart(df, x="distance", y="power", x_label="Distance (km)", y_label="Power (W)")
-        zone_counts = round(df["zone"].value_counts(normalize=True).sort_index() * 100, 1)
-        zone_durations = [str(timedelta(seconds=zone_count)) for zone_count in df["zone"].value_counts().sort_index()]
+        time_in_zones = POWER_ZONES.time_in_zones(df["power"].to_numpy(), ftp)
         zone_counts_df = pd.DataFrame(
             {
-                "Description": [set_colors(zone, color) for zone, color in zip(ZONES, ZONE_COLORS)],
-                "Range": [get_zone_range(zone, ftp) for zone in range(len(ZONES))],
-                "Zone": zone_counts.index + 1,
-                "Percent": zone_counts.values,
-                "Duration": zone_durations,
+                "Description": [set_colors(zone, color) for zone, color in zip(POWER_ZONES.names, POWER_ZONES.colors)],
+                "Range": POWER_ZONES.ranges(ftp),
+                "Zone": np.arange(len(POWER_ZONES.names)) + 1,
+                "Percent": np.round(time_in_zones / time_in_zones.sum() * 100, 1),
+                "Duration": [str(timedelta(seconds=int(seconds))) for seconds in time_in_zones],
             }
         )
 
@@ -179,14 +181,11 @@ if uploaded_file is not None:
             "30m",
             "1h",
         ]
-        rolling_avg_series = {}
-        for duration in rolling_avg_durations:
-            duration_seconds = int(pd.to_timedelta(duration).total_seconds())
-            rolling_avg_series[duration] = df["power"].rolling(window=duration_seconds).mean().dropna()
-        df_rolling_avg = pd.DataFrame(rolling_avg_series)
-        df_rolling_avg_max = df_rolling_avg.max()
-        df_rolling_avg_max = pd.DataFrame(df_rolling_avg_max).reset_index()
-        df_rolling_avg_max.columns = ["Duration", "Max"]
+        power = df["power"].to_numpy(dtype="float64")
+        durations = [int(pd.to_timedelta(duration).total_seconds()) for duration in rolling_avg_durations]
+        df_rolling_avg_max = pd.DataFrame(
+            {"Duration": rolling_avg_durations, "Max": get_mean_max_power(power, np.array(durations))}
+        )
         chart = (
             alt.Chart(df_rolling_avg_max)
             .mark_bar()
@@ -194,12 +193,25 @@ if uploaded_file is not None:
         )
         st.altair_chart(chart, use_container_width=True)
 
+        st.subheader("Power Duration Curve")
+        curve_durations = get_power_curve_durations(len(power))
+        df_power_curve = pd.DataFrame({"Duration": curve_durations, "Max": get_mean_max_power(power, curve_durations)})
+        chart = (
+            alt.Chart(df_power_curve)
+            .mark_line(color=Colors.ORANGE)
+            .encode(
+                x=alt.X("Duration", title="Duration (s)", scale=alt.Scale(type="log")),
+                y=alt.Y("Max", title="Max Power (W)"),
+                tooltip=["Duration", alt.Tooltip("Max", format=".0f")],
+            )
+        )
+        st.altair_chart(chart, use_container_width=True)
+
         st.subheader("Training Intensity")
         col1, col2, col3 = st.columns(3)
-        normalized_power = (rolling_avg_series["30s"] ** 4).mean() ** 0.25
-        intensity_factor = normalized_power / ftp
-        tss = intensity_factor**2 * moving_time_seconds / 3600 * 100
-        col1.metric("NP", f"{normalized_power:.0f} W")
+        intensity_factor = summary.intensity_factor(ftp)
+        tss = summary.tss(ftp)
+        col1.metric("NP", f"{summary.normalized_power:.0f} W")
         col2.metric("IF", f"{intensity_factor:.2f}")
         col3.metric("TSS", f"{tss:.0f}")
 
@@ -1,20 +1,8 @@
-import pandas as pd
-from tcxreader.tcxreader import TCXReader, TCXTrackPoint
-
-MPS_TO_KPH = 3.6
-MPS_TO_MPH = 2.23694
+from datetime import datetime
+from typing import List
 
-ZONES = [
-    "Active Recovery",
-    "Endurance",
-    "Tempo",
-    "Threshold",
-    "VO2",
-    "Anaerobic Capacity",
-    "Neuromuscular Power",
-]
-
-ZONE_COLORS = ["gray", None, "blue", "green", "orange", "red", "violet"]
+import pandas as pd
+from pmc import get_pmc
 
 
 class Colors:
@@ -28,40 +16,16 @@ class Colors:
     BLUE = "#1D1BF9"
 
 
-def get_tcx_data(tcx_file):
-    reader = TCXReader()
-    return reader.read(tcx_file)
-
-
-def tcx_to_df(tcx_data, kph: bool) -> pd.DataFrame:
-    trackpoint_data = []
-    trackpoint: TCXTrackPoint
-
-    for trackpoint in tcx_data.trackpoints:
-        speed = trackpoint.tpx_ext.get("Speed")
-        speed = speed * (MPS_TO_KPH if kph else MPS_TO_MPH)
-        trackpoint_data.append(
-            {
-                "time": trackpoint.time,
-                "distance": trackpoint.distance,
-                "speed": speed,
-                "power": trackpoint.tpx_ext.get("Watts"),
-                "cadence": trackpoint.cadence,
-                "latitude": trackpoint.latitude,
-                "longitude": trackpoint.longitude,
-                "elevation": trackpoint.elevation,
-                "heart_rate": trackpoint.hr_value,
-            }
-        )
-    df = pd.DataFrame(trackpoint_data)
-    df.set_index("time", inplace=True)
-    return df
+def get_daily_tss(
+    start_times: List[datetime], l_tss: List[float], start_date: datetime, end_date: datetime
+) -> pd.Series:
+    """Total TSS of each calendar day from start_date to end_date, 0 on days without rides."""
+    days = pd.date_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize(), freq="D")
+    tss = pd.Series(l_tss, index=pd.to_datetime([start_time.date() for start_time in start_times]), dtype="float64")
+    return tss.groupby(level=0).sum().reindex(days, fill_value=0.0)
 
 
-def get_zone(power: float, ftp: float) -> int:
-    zones_upper_thresh = [0.55, 0.75, 0.9, 1.05, 1.2, 1.5]
-    percentage = power / ftp
-    for idx, thresh in enumerate(zones_upper_thresh):
-        if percentage < thresh:
-            return idx
-    return len(zones_upper_thresh)
+def get_training_load(daily_tss: pd.Series, ctl_days: int = 42, atl_days: int = 7) -> pd.DataFrame:
+    """Performance Management Chart of a daily TSS series, as CTL, ATL and TSB columns indexed by Date."""
+    ctl, atl, tsb = get_pmc(daily_tss.to_numpy(), ctl_days, atl_days)
+    return pd.DataFrame({"CTL": ctl, "ATL": atl, "TSB": tsb}, index=daily_tss.index.rename("Date"))
@@ -0,0 +1,170 @@
+"""Parallel, cached ingest of the TCX files in the history directory.
+
+Each parsed file is stored as ``<history_dir>/.cache/<content hash>.parquet`` and ``index.parquet`` maps every file
+name to its size, mtime and content hash. Files whose size and mtime match the index are not read at all, touched
+files with unchanged content are not parsed again, and only new or changed files are parsed, in a process pool.
+Ingests hold the ``file_lock`` lock of the cache directory, so dashboard sessions and a watching ingest never drop
+each other's index entries or cache files.
+
+Ingest the history ahead of time, optionally watching the directory for new rides:
+
+    python history.py --history-dir history --watch
+"""
+
+import argparse
+import hashlib
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import pandas as pd
+from tcx import SPEED_UNITS, read_tcx
+
+# Cache files are locked and written the way the dashboard's are
+sys.path.append(str(Path(__file__).resolve().parents[2] / "app"))
+from file_lock import unique_tmp_path, user_lock  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIRNAME = ".cache"
+INDEX_FILENAME = "index.parquet"
+
+
+def _content_hash(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _parse_to_cache(path: Path, cache_path: Path):
+    """Parse a TCX file into its cache file, run in the worker processes so DataFrames are never pickled back."""
+    tmp_path = unique_tmp_path(cache_path)
+    read_tcx(path).to_parquet(tmp_path)
+    tmp_path.replace(cache_path)
+
+
+def list_tcx_files(history_dir: Path) -> List[Path]:
+    """TCX files in the history directory, sorted by date prefix."""
+    return sorted(history_dir.glob("*.tcx"))
+
+
+def get_history_fingerprint(history_dir: Path) -> Tuple[Tuple[str, int, int], ...]:
+    """Name, size and mtime of every TCX file, changes whenever a file is added, changed or removed."""
+    fingerprint = []
+    for file in list_tcx_files(history_dir):
+        stat = file.stat()
+        fingerprint.append((file.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+def load_index(history_dir: Path) -> pd.DataFrame:
+    """Size, mtime and content hash of the ingested files, indexed by file name."""
+    index_path = history_dir / CACHE_DIRNAME / INDEX_FILENAME
+    if not index_path.exists():
+        return pd.DataFrame(
+            {
+                "size": pd.Series(dtype="int64"),
+                "mtime_ns": pd.Series(dtype="int64"),
+                "content_hash": pd.Series(dtype="object"),
+            },
+            index=pd.Index([], dtype="object", name="name"),
+        )
+    return pd.read_parquet(index_path)
+
+
+def ingest_history(history_dir: Path, max_workers: Optional[int] = None) -> pd.DataFrame:
+    """Parse new or changed TCX files into the cache and return the updated index, sorted by file name."""
+    cache_dir = history_dir / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Held from reading the index to dropping unreferenced cache files, which a concurrent ingest may have just parsed
+    with user_lock(cache_dir):
+        index = load_index(history_dir)
+
+        entries, to_parse = {}, {}
+        for name, size, mtime_ns in get_history_fingerprint(history_dir):
+            if name in index.index and (index.at[name, "size"], index.at[name, "mtime_ns"]) == (size, mtime_ns):
+                entries[name] = index.loc[name].to_dict()
+                continue
+            content_hash = _content_hash(history_dir / name)
+            entries[name] = {"size": size, "mtime_ns": mtime_ns, "content_hash": content_hash}
+            if not (cache_dir / f"{content_hash}.parquet").exists():
+                to_parse[content_hash] = history_dir / name
+
+        if to_parse:
+            logger.info("Parsing %d new or changed TCX files in %s", len(to_parse), history_dir)
+            cache_paths = [cache_dir / f"{content_hash}.parquet" for content_hash in to_parse]
+            if max_workers == 1 or len(to_parse) == 1:
+                for path, cache_path in zip(to_parse.values(), cache_paths):
+                    _parse_to_cache(path, cache_path)
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    list(executor.map(_parse_to_cache, to_parse.values(), cache_paths))
+
+        new_index = index.iloc[:0]
+        if entries:
+            new_index = (
+                pd.DataFrame.from_dict(entries, orient="index").rename_axis("name").astype(index.dtypes.to_dict())
+            )
+        if not new_index.equals(index):
+            tmp_path = unique_tmp_path(cache_dir / INDEX_FILENAME)
+            new_index.to_parquet(tmp_path)
+            tmp_path.replace(cache_dir / INDEX_FILENAME)
+            # Drop the cache files of removed or changed TCX files
+            referenced = set(new_index["content_hash"])
+            for cache_path in cache_dir.glob("*.parquet"):
+                if cache_path.name != INDEX_FILENAME and cache_path.stem not in referenced:
+                    cache_path.unlink()
+    return new_index
+
+
+def load_history(
+    history_dir: Path,
+    columns: Optional[Sequence[str]] = None,
+    speed_unit: str = "mps",
+    max_workers: Optional[int] = None,
+) -> List[pd.DataFrame]:
+    """Trackpoints of every TCX file in the history directory, sorted by file name, parsing only uncached files."""
+    cache_dir = history_dir / CACHE_DIRNAME
+    dfs = []
+    # The cache files of the index are only dropped by another ingest, which waits for the lock
+    with user_lock(cache_dir):
+        index = ingest_history(history_dir, max_workers)
+        for content_hash in index["content_hash"]:
+            df = pd.read_parquet(
+                cache_dir / f"{content_hash}.parquet", columns=None if columns is None else list(columns)
+            )
+            if "speed" in df.columns:
+                df["speed"] = df["speed"] * SPEED_UNITS[speed_unit]
+            dfs.append(df)
+    return dfs
+
+
+def watch_history(history_dir: Path, interval: float = 10.0, max_workers: Optional[int] = None):
+    """Ingest the history directory whenever a TCX file is added, changed or removed, until interrupted."""
+    fingerprint = None
+    while True:
+        new_fingerprint = get_history_fingerprint(history_dir)
+        if new_fingerprint != fingerprint:
+            index = ingest_history(history_dir, max_workers)
+            logger.info("%d TCX files ingested from %s", len(index), history_dir)
+            fingerprint = new_fingerprint
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    parser = argparse.ArgumentParser(description="Ingest the TCX files of the history directory into its cache.")
+    parser.add_argument("--history-dir", type=Path, default=Path("history"), help="Directory of the TCX files.")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default is the CPU count).")
+    parser.add_argument("--watch", action="store_true", help="Keep ingesting new or changed files until interrupted.")
+    parser.add_argument("--interval", type=float, default=10.0, help="Seconds between directory scans when watching.")
+    args = parser.parse_args()
+    if args.watch:
+        watch_history(args.history_dir, args.interval, args.workers)
+    else:
+        ingest_history(args.history_dir, args.workers)
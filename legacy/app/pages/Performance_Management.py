@@ -1,18 +1,25 @@
 import re
-from collections import defaultdict
+import sys
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import altair as alt
 import ollama
 import pandas as pd
-import stqdm
 import streamlit as st
-from common import Colors, get_tcx_data, tcx_to_df
+
+# The ride summary and PMC kernels are shared with the dashboard
+sys.path.append(str(Path(__file__).resolve().parents[3] / "app"))
+from common import Colors, get_daily_tss, get_training_load  # noqa: E402
+from history import get_history_fingerprint, load_history  # noqa: E402
+from summary import get_ride_summary  # noqa: E402
+from zones import POWER_ZONES, get_time_in_zone_report  # noqa: E402
 
 # History directory containing all the TCX files
 HISTORY_DIR = Path("history")
 LLM = "cycling-qwen2.5:7b"
+# Interval between scans of the history directory when watching it
+WATCH_INTERVAL = "10s"
 
 if "messages_progress" not in st.session_state:
     st.session_state["messages_progress"] = []
@@ -21,11 +28,6 @@ if "summary_progress" not in st.session_state:
     st.session_state["summary_progress"] = []
 
 
-def list_tcx_files():
-    """Load all the TCX files in the history directory, sorted by date prefix"""
-    return sorted(HISTORY_DIR.glob("*.tcx"))
-
-
 def model_res_generator():
     messages = (
         st.session_state["messages_progress"] + st.session_state["messages_progress"]
@@ -53,18 +55,20 @@ def model_res(messages):
 
 
 @st.cache_data()
-def get_history_dfs() -> list[pd.DataFrame]:
-    tcx_files = list_tcx_files()
-    return [tcx_to_df(get_tcx_data(file), kph=True) for file in stqdm.stqdm(tcx_files, desc="Loading TCX files")]
+def get_history_dfs(fingerprint: tuple) -> list[pd.DataFrame]:
+    """Keyed by the history fingerprint, only files that are new or changed since the last ingest are parsed."""
+    return load_history(HISTORY_DIR, columns=["speed", "power"], speed_unit="kph")
+
+
+@st.fragment(run_every=WATCH_INTERVAL)
+def watch_history_dir(fingerprint: tuple):
+    """Rerun the page once a TCX file is added, changed or removed."""
+    if get_history_fingerprint(HISTORY_DIR) != fingerprint:
+        st.rerun()
 
 
 def get_tss(df: pd.DataFrame, ftp: float) -> float:
-    moving_time_seconds = df[df["speed"] > 0].shape[0]
-    pwr_rollings = df["power"].rolling(window=30).mean().dropna()
-    normalized_power = (pwr_rollings**4).mean() ** 0.25
-    intensity_factor = normalized_power / ftp
-    tss = intensity_factor**2 * moving_time_seconds / 3600 * 100
-    return tss
+    return get_ride_summary(power=df["power"].to_numpy(), speed=df["speed"].to_numpy()).tss(ftp)
 
 
 def get_start_time(df: pd.DataFrame) -> datetime:
@@ -75,8 +79,12 @@ def get_start_time(df: pd.DataFrame) -> datetime:
 st.set_page_config(page_title="Performance Management", page_icon=":bicyclist:")
 st.title("Performance Management")
 
-st.write("Number of activities:", len(list_tcx_files()))
-dfs = get_history_dfs()
+history_fingerprint = get_history_fingerprint(HISTORY_DIR)
+st.write("Number of activities:", len(history_fingerprint))
+if st.toggle("Watch history directory", help="Pick up new TCX files without reloading the page."):
+    watch_history_dir(history_fingerprint)
+with st.spinner("Loading TCX files..."):
+    dfs = get_history_dfs(history_fingerprint)
 ftp = st.number_input("Functional Threshold Power (FTP)", 0, 1000, 200)
 
 
@@ -127,6 +135,14 @@ with st.expander("Reference Training Volume Guidelines", expanded=True):
         icon="ℹ️",
     )
 
+# --- Time in Zone ---
+st.header("Monthly Time in Zone")
+
+time_in_zones = POWER_ZONES.batch_time_in_zones([df["power"].to_numpy() for df in dfs], ftp)
+df_time_in_zone = get_time_in_zone_report(start_times, time_in_zones, POWER_ZONES, freq="MS")
+df_time_in_zone = df_time_in_zone[df_time_in_zone.index >= weeks[0]]
+st.bar_chart(df_time_in_zone, y_label="Hours", use_container_width=True)
+
 TRAINING_LOAD_TIMEFRAME = 120  # 1 Quarter
 
 # --- Training Load ---
@@ -145,28 +161,9 @@ st.write(
     "Calculate Chronic Training Load (CTL), Acute Training Load (ATL), and Training Stress Balance (TSB) for 1 quarter (120 days)"
 )
 
-a_ctl = 2 / (42 + 1)
-a_atl = 2 / (7 + 1)
-
-date_to_tss = defaultdict(lambda: 0.0)
-for tss, start_time in zip(l_tss, start_times):
-    date = start_time.date()
-    date_to_tss[date] += tss
-
 start_date = today - timedelta(days=TRAINING_LOAD_TIMEFRAME)
-training_load = {"Date": [], "CTL": [], "ATL": [], "TSB": []}
-for i in range(TRAINING_LOAD_TIMEFRAME + 1):
-    date = start_date + timedelta(days=i)
-    training_load["Date"].append(date)
-    last_ctl = training_load["CTL"][-1] if training_load["CTL"] else 0
-    last_atl = training_load["ATL"][-1] if training_load["ATL"] else 0
-    current_ctl = last_ctl * (1 - a_ctl) + date_to_tss.get(date.date(), 0) * a_ctl
-    current_atl = last_atl * (1 - a_atl) + date_to_tss.get(date.date(), 0) * a_atl
-    training_load["TSB"].append(current_ctl - current_atl)
-    training_load["CTL"].append(current_ctl)
-    training_load["ATL"].append(current_atl)
-
-training_load_df = pd.DataFrame(training_load).set_index("Date")
+daily_tss = get_daily_tss(start_times, l_tss, start_date, today)
+training_load_df = get_training_load(daily_tss)
 
 st.subheader("Chronic Training Load (CTL)")
 st.line_chart(training_load_df, y="CTL", color=Colors.BLUE, use_container_width=True)
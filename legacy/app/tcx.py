@@ -0,0 +1,103 @@
+"""Streaming TCX parser shared by the legacy dashboard and tools.
+
+Trackpoints are read with ``iterparse`` and written straight into preallocated NumPy arrays, each trackpoint element
+is emptied once read, so neither the whole XML tree nor one Python object per trackpoint is kept.
+"""
+
+from pathlib import Path
+from typing import IO, Dict, Optional, Sequence, Union
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+import pandas as pd
+
+MPS_TO_KPH = 3.6
+MPS_TO_MPH = 2.23694
+SPEED_UNITS = {"mps": 1.0, "kph": MPS_TO_KPH, "mph": MPS_TO_MPH}
+
+# Trackpoint elements by their tag without namespace, HeartRateBpm holds its reading in a Value element
+TCX_FIELDS = {
+    "DistanceMeters": "distance",
+    "Speed": "speed",
+    "Watts": "power",
+    "Cadence": "cadence",
+    "LatitudeDegrees": "latitude",
+    "LongitudeDegrees": "longitude",
+    "AltitudeMeters": "elevation",
+    "Value": "heart_rate",
+}
+TCX_COLUMNS = list(TCX_FIELDS.values())
+
+# Initial capacity when the file size is unknown, and bytes per trackpoint to estimate it from the file size
+DEFAULT_CAPACITY = 4096
+BYTES_PER_TRACKPOINT = 256
+
+
+def _local_name(names: Dict[str, str], tag: str) -> str:
+    if tag not in names:
+        names[tag] = tag.rpartition("}")[2]
+    return names[tag]
+
+
+def parse_tcx(source: Union[str, Path, IO], columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """Trackpoint times and fields of a TCX file as arrays, NaN where a trackpoint lacks a field.
+
+    ``columns`` restricts the fields that are stored, e.g. ``["speed", "power"]``; "time" is always returned, as
+    timezone-naive UTC like ``TCXReader`` returns Strava's ``Z`` timestamps.
+    """
+    columns = TCX_COLUMNS if columns is None else [column for column in columns if column in TCX_COLUMNS]
+    name_to_column = {name: column for name, column in TCX_FIELDS.items() if column in columns}
+    capacity = DEFAULT_CAPACITY
+    if isinstance(source, (str, Path)):
+        capacity = max(capacity, Path(source).stat().st_size // BYTES_PER_TRACKPOINT)
+    times = np.empty(capacity, dtype="U32")
+    arrays = {column: np.full(capacity, np.nan) for column in columns}
+
+    # Namespaced tag to local name, computed once per distinct tag
+    names = {}
+    count = 0
+    for _, elem in iterparse(source, events=("end",)):
+        if _local_name(names, elem.tag) != "Trackpoint":
+            continue
+        if count == capacity:
+            capacity *= 2
+            times = np.resize(times, capacity)
+            for column, array in arrays.items():
+                arrays[column] = np.concatenate([array, np.full(capacity - len(array), np.nan)])
+        for child in elem.iter():
+            name = _local_name(names, child.tag)
+            if name == "Time":
+                times[count] = child.text
+            elif name in name_to_column and child.text:
+                try:
+                    arrays[name_to_column[name]][count] = float(child.text)
+                except ValueError:
+                    pass
+        count += 1
+        # Only the emptied element stays in the tree
+        elem.clear()
+
+    parsed_times = pd.to_datetime(times[:count], format="ISO8601", utc=True).tz_localize(None).to_numpy()
+    return {"time": parsed_times, **{column: array[:count] for column, array in arrays.items()}}
+
+
+def read_tcx(
+    source: Union[str, Path, IO],
+    columns: Optional[Sequence[str]] = None,
+    speed_unit: str = "mps",
+    timezone_offset: float = 0,
+    only_gps: bool = True,
+) -> pd.DataFrame:
+    """Trackpoints of a TCX file as a DataFrame indexed by time, one column per field.
+
+    Speed is converted to ``"mps"``, ``"kph"`` or ``"mph"`` and times are shifted from UTC by ``timezone_offset``
+    hours. With ``only_gps``, trackpoints without a position are dropped like ``TCXReader`` does.
+    """
+    projection = None if columns is None else list(columns) + (["longitude"] if only_gps else [])
+    data = parse_tcx(source, projection)
+    keep = ~np.isnan(data["longitude"]) if only_gps else slice(None)
+    if "speed" in data:
+        data["speed"] = data["speed"] * SPEED_UNITS[speed_unit]
+    index = pd.DatetimeIndex(data.pop("time")[keep] + np.timedelta64(round(timezone_offset * 3600), "s"), name="time")
+    columns = [column for column in TCX_COLUMNS if column in data] if columns is None else list(columns)
+    return pd.DataFrame({column: data[column][keep] for column in columns}, index=index)
@@ -0,0 +1,88 @@
+"""Training zone models, vectorized classification and time-in-zone totals."""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class ZoneModel:
+    """Zones defined by their lower bounds as fractions of a reference value, e.g. FTP or threshold heart rate."""
+
+    unit: str
+    names: List[str]
+    colors: List[Optional[str]]
+    lower_bounds: List[float]
+
+    def classify(self, values: np.ndarray, reference: float) -> np.ndarray:
+        """Zone index of every sample, -1 for missing samples.
+
+        Samples are compared as fractions of the reference, a bound scaled to the unit of the model may round above
+        a sample on it, e.g. ``0.55 * 200``.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        zones = np.searchsorted(self.lower_bounds[1:], values / reference, side="right")
+        return np.where(np.isnan(values), -1, zones)
+
+    def time_in_zones(self, values: np.ndarray, reference: float, sample_seconds: float = 1.0) -> np.ndarray:
+        """Seconds spent in each zone by a stream sampled every sample_seconds, missing samples are not counted."""
+        zones = self.classify(values, reference)
+        return np.bincount(zones[zones >= 0], minlength=len(self.names)) * sample_seconds
+
+    def batch_time_in_zones(
+        self, rides: Iterable[np.ndarray], reference: float, sample_seconds: float = 1.0
+    ) -> np.ndarray:
+        """Seconds spent in each zone by many rides, as a (rides, zones) array from a single ``bincount``."""
+        rides = [np.asarray(values, dtype=np.float64) for values in rides]
+        if not rides:
+            return np.zeros((0, len(self.names)))
+        zones = self.classify(np.concatenate(rides), reference)
+        ride_index = np.repeat(np.arange(len(rides)), [len(values) for values in rides])
+        valid = zones >= 0
+        counts = np.bincount(ride_index[valid] * len(self.names) + zones[valid], minlength=len(rides) * len(self.names))
+        return counts.reshape(len(rides), len(self.names)) * sample_seconds
+
+    def ranges(self, reference: float) -> List[str]:
+        """Human-readable range of every zone, e.g. ``"150 - 188 W"``."""
+        bounds = np.asarray(self.lower_bounds) * reference
+        ranges = [f"{lower:.0f} - {upper:.0f} {self.unit}" for lower, upper in zip(bounds[:-1], bounds[1:])]
+        return ranges + [f"{bounds[-1]:.0f}+ {self.unit}"]
+
+
+POWER_ZONES = ZoneModel(
+    unit="W",
+    names=[
+        "Active Recovery",
+        "Endurance",
+        "Tempo",
+        "Threshold",
+        "VO2",
+        "Anaerobic Capacity",
+        "Neuromuscular Power",
+    ],
+    colors=["gray", None, "blue", "green", "orange", "red", "violet"],
+    lower_bounds=[0, 0.55, 0.75, 0.9, 1.05, 1.2, 1.5],
+)
+
+# Coggan's zones as fractions of the lactate threshold heart rate
+HEART_RATE_ZONES = ZoneModel(
+    unit="bpm",
+    names=["Active Recovery", "Endurance", "Tempo", "Threshold", "VO2"],
+    colors=["gray", None, "blue", "green", "orange"],
+    lower_bounds=[0, 0.69, 0.84, 0.95, 1.06],
+)
+
+
+def get_time_in_zone_report(
+    start_times: Sequence[datetime], time_in_zones: np.ndarray, model: ZoneModel, freq: str = "MS"
+) -> pd.DataFrame:
+    """Hours spent in each zone per period, e.g. ``"W-MON"`` or ``"MS"``, from the per-ride totals of a batch."""
+    hours = pd.DataFrame(
+        np.asarray(time_in_zones) / 3600,
+        index=pd.DatetimeIndex([pd.Timestamp(start_time).replace(tzinfo=None) for start_time in start_times]),
+        columns=model.names,
+    )
+    return hours.resample(freq, label="left", closed="left").sum().rename_axis("Date")
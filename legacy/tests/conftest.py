@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests import the legacy app modules the way its pages do
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
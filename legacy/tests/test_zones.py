@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from zones import HEART_RATE_ZONES, POWER_ZONES
+
+
+@pytest.mark.parametrize(
+    "model, reference, bounds",
+    [
+        (POWER_ZONES, 200, [110, 150, 180, 210, 240, 300]),
+        (POWER_ZONES, 280, [154, 210, 252, 294, 336, 420]),
+        (POWER_ZONES, 300, [165, 225, 270, 315, 360, 450]),
+        (HEART_RATE_ZONES, 100, [69, 84, 95, 106]),
+        (HEART_RATE_ZONES, 200, [138, 168, 190, 212]),
+    ],
+)
+def test_classify_boundaries(model, reference, bounds):
+    bounds = np.asarray(bounds, dtype=np.float64)
+    # A sample on a lower bound is in the zone it starts, one just below it in the zone before
+    np.testing.assert_array_equal(model.classify(bounds, reference), np.arange(1, len(model.names)))
+    np.testing.assert_array_equal(model.classify(bounds - 0.5, reference), np.arange(len(model.names) - 1))
+
+
+def test_classify_matches_ranges():
+    ftp = 200
+    labels = POWER_ZONES.ranges(ftp)
+    assert labels[1] == "110 - 150 W"
+    zones = POWER_ZONES.classify(np.array([0, 109, 110, 149, 150, 300, 1000, np.nan]), ftp)
+    np.testing.assert_array_equal(zones, [0, 0, 1, 1, 2, 6, 6, -1])
+
+
+def test_time_in_zones_counts_boundary_samples():
+    seconds = POWER_ZONES.time_in_zones(np.array([110.0, 150.0, 150.0, np.nan]), 200)
+    np.testing.assert_array_equal(seconds, [0, 1, 2, 0, 0, 0, 0])
+    batch = POWER_ZONES.batch_time_in_zones([np.array([110.0]), np.array([150.0, 150.0])], 200)
+    np.testing.assert_array_equal(batch.sum(axis=0), seconds)
@@ -1,101 +1,109 @@
 import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
 import time
-from dataclasses import dataclass
-from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Tuple
 
 import cv2
 import numpy as np
 import pandas as pd
-from PIL import Image, ImageDraw, ImageFont
-from tcxreader.tcxreader import TCXReader, TCXTrackPoint
-from tqdm import tqdm
-
-MPS_TO_KPH = 3.6
-MPS_TO_MPH = 2.23694
-
-
-def get_font(fontsize: int, name: str = "american-captain"):
-    available_fonts = {
-        "american-captain": "fonts/american-captain-font/AmericanCaptain-MdEY.ttf",
-        "damion": "fonts/damion-font/Damion-8gnD.ttf",
-        "landasans": "fonts/landasans-font/LandasansMedium-ALJ6m.ttf",
-    }
-    return ImageFont.truetype(available_fonts[name], fontsize)
-
-
-class Colors:
-    """Colors in BGRA"""
-
-    WHITE = (255, 255, 255, 1)
-    RED = (0, 0, 255, 1)
-    GREEN = (0, 255, 0, 1)
-    BLUE = (255, 0, 0, 1)
-    BLACK = (0, 0, 0, 1)
-
-
-@dataclass
-class TextDrawInstruction:
-    text: str
-    xy: Tuple[int, int]
-    color: Tuple = Colors.WHITE
-    font: Optional[ImageFont.FreeTypeFont] = None
-
-
-def draw_instructions(frame: np.ndarray, instructions: List[TextDrawInstruction]) -> np.ndarray:
-    image = Image.fromarray(frame)
-    draw = ImageDraw.Draw(image)
-    for instruction in instructions:
-        draw.text(instruction.xy, instruction.text, fill=instruction.color, font=instruction.font)
-    return np.array(image)
-
-
-def text_rows_instructions(
-    text_rows: List[Tuple[str, str]],
-    start_xy: Tuple[int, int],
-    fontsizes: Optional[Tuple[int, int]] = None,
-    line_spacing: Optional[Tuple[int, int]] = None,
-    color: Tuple = Colors.WHITE,
-) -> List[TextDrawInstruction]:
-    _fontsizes = (100, 200) if fontsizes is None else fontsizes
-    _line_spacing = (90, 200) if line_spacing is None else line_spacing
-
-    instructions = []
-    x, y = start_xy
-    for desc, value in text_rows:
-        desc_instruction = TextDrawInstruction(desc, (x, y), color=color, font=get_font(_fontsizes[0]))
-        y += _line_spacing[0]
-        value_instruction = TextDrawInstruction(value, (x, y), color=color, font=get_font(_fontsizes[1]))
-        y += _line_spacing[1]
-        instructions += [desc_instruction, value_instruction]
-    return instructions
+from overlay import OverlayRenderer
+from telemetry import TelemetryTrack
+from video_pipeline import PipelineStats, concat_videos, open_writer, run_pipeline
+
+# The TCX parser is shared with the dashboard
+sys.path.append(str(Path(__file__).resolve().parent.parent / "app"))
+from tcx import read_tcx  # noqa: E402
 
 
 def tcx_to_df(tcx_file: Path, timezone: int, kph: bool) -> pd.DataFrame:
-    reader = TCXReader()
-    data = reader.read(str(tcx_file))
-    trackpoint_data = []
-    trackpoint: TCXTrackPoint
-    timezone_offset = timedelta(hours=timezone)
-
-    for trackpoint in tqdm(data.trackpoints):
-        time_adjusted = trackpoint.time + timezone_offset
-        speed = trackpoint.tpx_ext.get("Speed")
-        power = trackpoint.tpx_ext.get("Watts")
-
-        speed = speed * (MPS_TO_KPH if kph else MPS_TO_MPH)
-        trackpoint_data.append(
-            {
-                "Time": time_adjusted,
-                "Speed": speed,
-                "Elevation": trackpoint.elevation,
-                "Power": power,
-            }
+    df = read_tcx(
+        tcx_file, columns=["speed", "elevation", "power"], speed_unit="kph" if kph else "mph", timezone_offset=timezone
+    )
+    df = df.rename(columns={"speed": "Speed", "elevation": "Elevation", "power": "Power"})
+    return df.rename_axis("Time")
+
+
+def render_chunk(args, track: TelemetryTrack, output_filename: str, start_frame: int = 0):
+    """Render the frames of the input video from a start frame on, one per frame of the telemetry track.
+
+    Returns the number of frames written.
+    """
+    cap = cv2.VideoCapture(args.input_video)
+    if not cap.isOpened():
+        print("Error opening video file")
+        return 0
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    renderer = OverlayRenderer(width, height)
+
+    out = None
+    if not args.debug:
+        out = open_writer(output_filename, fps, (width, height), ffmpeg=args.ffmpeg, codec=args.codec)
+
+    def render(frame: np.ndarray, idx: int) -> np.ndarray:
+        return renderer.render(frame, track.text_rows(idx))
+
+    def encode(idx: int, frame: np.ndarray, _) -> bool:
+        if out is None:
+            cv2.imshow("Video Playback", frame)
+            return cv2.waitKey(25) & 0xFF != ord("q")
+        out.write(frame)
+        return True
+
+    def progress(idx: int, _, stats: PipelineStats):
+        print(
+            f"{track.timestamp(idx)}: Process {idx}/{len(track)} frames ({100 * idx // len(track)}%), {stats.summary()}"
+        )
+
+    try:
+        stats = run_pipeline(
+            cap,
+            lambda idx: idx,
+            render,
+            encode,
+            num_frames=len(track),
+            workers=args.workers or max(1, os.cpu_count() // args.processes),
+            queue_size=args.queue_size,
+            progress=progress,
+            progress_every=max(round(fps), 1),
         )
-    df = pd.DataFrame(trackpoint_data)
-    df.set_index("Time", inplace=True)
-    return df
+        print(f"Frames {start_frame} to {start_frame + stats.stages['encode'].frames} done, {stats.summary()}")
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+        if args.debug:
+            cv2.destroyAllWindows()
+    return stats.stages["encode"].frames
+
+
+def render_chunks(args, track: TelemetryTrack, output_filename: str, start_frame: int = 0):
+    """Render time ranges of the input video in parallel processes and concatenate them."""
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("Rendering with --processes needs ffmpeg on PATH to concatenate the chunks")
+    chunk_frames = math.ceil(len(track) / args.processes)
+    output_path = Path(output_filename)
+    t1 = time.monotonic()
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as chunk_dir:
+        chunk_paths = []
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = []
+            for chunk, offset in enumerate(range(0, len(track), chunk_frames)):
+                chunk_path = Path(chunk_dir) / f"chunk-{chunk:03d}{output_path.suffix}"
+                chunk_paths.append(chunk_path)
+                chunk_track = track[offset : offset + chunk_frames]
+                futures.append(executor.submit(render_chunk, args, chunk_track, str(chunk_path), start_frame + offset))
+            frames = sum(future.result() for future in futures)
+        concat_videos(chunk_paths, output_filename)
+    print(f"{frames} frames rendered by {args.processes} processes, {frames / (time.monotonic() - t1):.1f} FPS")
 
 
 def play_video(args):
@@ -104,71 +112,33 @@ def play_video(args):
     df = tcx_to_df(Path(args.input_file), args.timezone, args.kph)
     print("Loading TCX file [DONE]")
 
-    start_time = pd.to_datetime(args.start_time)
-    end_time = pd.to_datetime(args.end_time)
-    filtered_df = df[(df.index >= start_time) & (df.index <= end_time)]
-
-    df_iter = filtered_df.iterrows()
     cap = cv2.VideoCapture(args.input_video)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fourcc = cv2.VideoWriter_fourcc(*"avc1")
-    output_filename = input_video.stem + "-output.mp4" if args.output_path is None else args.output_path
-    out = cv2.VideoWriter(output_filename, fourcc, fps, (width, height))
-
-    idx = 0
-    process_fps = 0
-    speed, elevation = 0, 0
-
-    if not cap.isOpened():
+    cap.release()
+    if not fps or not total_frames:
         print("Error opening video file")
         return
 
-    while True:
-        t1 = time.monotonic()
-        ret, frame = cap.read()
-        if idx % fps == 0:
-            timestamp, row = next(df_iter)
-            if row is not None:
-                speed = row["Speed"]
-                elevation = row["Elevation"]
-                power = row["Power"]
-                power = power if not np.isnan(power) else 0.0
-                progress = 100 * idx // total_frames
-                print(f"{timestamp}: Process {idx}/{total_frames} frames ({progress}%), process FPS {process_fps:.1f}")
-            else:
-                speed, elevation, power = 0, 0, 0
-
-        if not ret:
-            print("End of video")
-            break
-
-        height, width, _ = frame.shape
-        text_overlay = frame.copy()
-
-        text_rows = [("KMH", str(round(speed))), ("PWR", str(round(power))), ("ALT", str(round(elevation)))]
-        instructions = text_rows_instructions(text_rows, start_xy=(300, 350))
-        instructions.append(
-            TextDrawInstruction("Chillriders Production", (width - 500, height - 100), font=get_font(50, "damion"))
-        )
-        text_overlay = draw_instructions(text_overlay, instructions=instructions)
+    # Without the time of the first frame, the video is taken to start at --start-time
+    start_time = df.index[0] if args.start_time is None else pd.to_datetime(args.start_time)
+    video_start_time = start_time if args.video_start_time is None else pd.to_datetime(args.video_start_time)
+    start_frame = round((start_time - video_start_time).total_seconds() * fps)
+    end_frame = total_frames
+    if args.end_time is not None:
+        end_frame = min(end_frame, round((pd.to_datetime(args.end_time) - video_start_time).total_seconds() * fps) + 1)
+    if not 0 <= start_frame < end_frame:
+        print("The start time is outside of the video")
+        return
 
-        # Blend the text overlay with the original frame with transparency level (alpha)
-        alpha = 0.8
-        output_frame = cv2.addWeighted(text_overlay, alpha, frame, 1 - alpha, 0)
-        if args.debug:
-            cv2.imshow("Video Playback", output_frame)
-            if cv2.waitKey(25) & 0xFF == ord("q"):
-                break
-        else:
-            out.write(output_frame)
-        idx += 1
-        t2 = time.monotonic()
-        process_fps = 1 / (t2 - t1)
-    cap.release()
-    cv2.destroyAllWindows()
+    track = TelemetryTrack.from_df(
+        df, start_time, fps, end_frame - start_frame, interpolate=args.interpolate, smooth=args.smooth
+    )
+    output_filename = input_video.stem + "-output.mp4" if args.output_path is None else args.output_path
+    if args.processes > 1 and not args.debug:
+        render_chunks(args, track, output_filename, start_frame)
+    else:
+        render_chunk(args, track, output_filename, start_frame)
 
 
 if __name__ == "__main__":
@@ -182,6 +152,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--end-time", type=str, default=None, help="End time of the video in YYYY-MM-DD HH:MM:SS format"
     )
+    parser.add_argument(
+        "--video-start-time",
+        type=str,
+        default=None,
+        help="Time of the first frame of the input video, rendering seeks to --start-time when given",
+    )
+    parser.add_argument(
+        "--interpolate", action="store_true", help="Interpolate the telemetry between samples for every frame"
+    )
+    parser.add_argument(
+        "--smooth", type=float, default=None, help="Average the telemetry over a centered window of this many seconds"
+    )
     parser.add_argument("--kph", action="store_true", help="Convert speed from mph to kph.")
     parser.add_argument(
         "--timezone",
@@ -189,6 +171,23 @@ if __name__ == "__main__":
         default=8,
         help="Timezone offset in hours (default is 8 for HKT).",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes rendering time ranges of the video in parallel, concatenated with ffmpeg",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of threads rendering the overlays per process (default is the CPU count divided by --processes)",
+    )
+    parser.add_argument("--queue-size", type=int, default=8, help="Maximum number of decoded frames in flight")
+    parser.add_argument(
+        "--ffmpeg", action="store_true", help="Encode by piping raw frames to ffmpeg instead of cv2.VideoWriter"
+    )
+    parser.add_argument("--codec", type=str, default="libx264", help="ffmpeg video codec (default is libx264)")
     parser.add_argument(
         "--debug",
         action="store_true",
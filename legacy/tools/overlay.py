@@ -0,0 +1,165 @@
+"""Text overlays rasterized once and alpha-composited onto video frames with NumPy.
+
+Drawing text with PIL and blending whole frames costs several full-frame passes per frame, far more than decoding a
+4K frame. The overlays only change when the telemetry does, so each one is rasterized into a small premultiplied
+layer when its text changes and only the pixels under it are blended into the frame.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+AVAILABLE_FONTS = {
+    "american-captain": "fonts/american-captain-font/AmericanCaptain-MdEY.ttf",
+    "damion": "fonts/damion-font/Damion-8gnD.ttf",
+    "landasans": "fonts/landasans-font/LandasansMedium-ALJ6m.ttf",
+}
+# Rasterized telemetry layers kept for reuse, values repeat as speed and power hover around the same numbers
+MAX_CACHED_LAYERS = 256
+
+
+@lru_cache(maxsize=None)
+def get_font(fontsize: int, name: str = "american-captain") -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(AVAILABLE_FONTS[name], fontsize)
+
+
+class Colors:
+    """Colors in BGRA"""
+
+    WHITE = (255, 255, 255, 1)
+    RED = (0, 0, 255, 1)
+    GREEN = (0, 255, 0, 1)
+    BLUE = (255, 0, 0, 1)
+    BLACK = (0, 0, 0, 1)
+
+
+@dataclass
+class TextDrawInstruction:
+    text: str
+    xy: Tuple[int, int]
+    color: Tuple = Colors.WHITE
+    font: Optional[ImageFont.FreeTypeFont] = None
+
+
+def text_rows_instructions(
+    text_rows: List[Tuple[str, str]],
+    start_xy: Tuple[int, int],
+    fontsizes: Optional[Tuple[int, int]] = None,
+    line_spacing: Optional[Tuple[int, int]] = None,
+    color: Tuple = Colors.WHITE,
+) -> List[TextDrawInstruction]:
+    _fontsizes = (100, 200) if fontsizes is None else fontsizes
+    _line_spacing = (90, 200) if line_spacing is None else line_spacing
+
+    instructions = []
+    x, y = start_xy
+    for desc, value in text_rows:
+        desc_instruction = TextDrawInstruction(desc, (x, y), color=color, font=get_font(_fontsizes[0]))
+        y += _line_spacing[0]
+        value_instruction = TextDrawInstruction(value, (x, y), color=color, font=get_font(_fontsizes[1]))
+        y += _line_spacing[1]
+        instructions += [desc_instruction, value_instruction]
+    return instructions
+
+
+@dataclass
+class OverlayLayer:
+    """Premultiplied color and alpha of an overlay, in 1/256 steps, at its position in the frame."""
+
+    x: int
+    y: int
+    color: np.ndarray  # (height, width, 3) uint16, color * alpha
+    alpha: np.ndarray  # (height, width, 1) uint16, 0 to 256
+
+    def composite(self, frame: np.ndarray):
+        """Blend the layer into the frame in place, only touching the pixels under it."""
+        x0, y0 = max(self.x, 0), max(self.y, 0)
+        x1 = min(self.x + self.alpha.shape[1], frame.shape[1])
+        y1 = min(self.y + self.alpha.shape[0], frame.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+        layer = np.s_[y0 - self.y : y1 - self.y, x0 - self.x : x1 - self.x]
+        region = frame[y0:y1, x0:x1]
+        blended = region * (256 - self.alpha[layer]) + self.color[layer]
+        region[:] = blended >> 8
+
+
+def render_layer(instructions: List[TextDrawInstruction], opacity: float = 1.0) -> Optional[OverlayLayer]:
+    """Rasterize text into a layer cropped to its visible pixels, None if nothing is visible.
+
+    Colors are in the channel order of the frame. ``opacity`` scales the alpha of the whole layer.
+    """
+    boxes = [
+        ImageDraw.Draw(Image.new("L", (1, 1))).textbbox(instruction.xy, instruction.text, font=instruction.font)
+        for instruction in instructions
+    ]
+    if not boxes:
+        return None
+    left, top = min(box[0] for box in boxes), min(box[1] for box in boxes)
+    right, bottom = max(box[2] for box in boxes), max(box[3] for box in boxes)
+    image = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for instruction in instructions:
+        x, y = instruction.xy
+        draw.text((x - left, y - top), instruction.text, fill=instruction.color[:3] + (255,), font=instruction.font)
+
+    crop = image.getbbox()
+    if crop is None:
+        return None
+    rgba = np.asarray(image.crop(crop), dtype=np.float64)
+    alpha = rgba[..., 3:] / 255 * opacity
+    color = rgba[..., :3] * alpha
+    return OverlayLayer(
+        x=left + crop[0],
+        y=top + crop[1],
+        color=np.round(color * 256).astype(np.uint16),
+        alpha=np.round(alpha * 256).astype(np.uint16),
+    )
+
+
+class OverlayRenderer:
+    """Telemetry text rows and a static caption over frames, each rasterized once per distinct text."""
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        opacity: float = 0.8,
+        start_xy: Tuple[int, int] = (300, 350),
+        caption: Optional[str] = "Chillriders Production",
+    ):
+        self.opacity = opacity
+        self.start_xy = start_xy
+        self.caption_layer = None
+        if caption:
+            self.caption_layer = render_layer(
+                [TextDrawInstruction(caption, (width - 500, height - 100), font=get_font(50, "damion"))], opacity
+            )
+        self._layers: "OrderedDict[Tuple[Tuple[str, str], ...], Optional[OverlayLayer]]" = OrderedDict()
+        # Frames may be rendered from several threads at once
+        self._lock = threading.Lock()
+
+    def get_layer(self, text_rows: List[Tuple[str, str]]) -> Optional[OverlayLayer]:
+        key = tuple(text_rows)
+        with self._lock:
+            if key in self._layers:
+                self._layers.move_to_end(key)
+                return self._layers[key]
+        layer = render_layer(text_rows_instructions(text_rows, start_xy=self.start_xy), self.opacity)
+        with self._lock:
+            self._layers[key] = layer
+            if len(self._layers) > MAX_CACHED_LAYERS:
+                self._layers.popitem(last=False)
+        return layer
+
+    def render(self, frame: np.ndarray, text_rows: List[Tuple[str, str]]) -> np.ndarray:
+        """Draw the text rows and the caption onto the frame in place and return it."""
+        for layer in (self.get_layer(text_rows), self.caption_layer):
+            if layer is not None:
+                layer.composite(frame)
+        return frame
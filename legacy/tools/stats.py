@@ -1,59 +1,49 @@
+"""Basic stats of TCX rides: a plot of speed and elevation, the trackpoints as CSV and a summary.
+
+A single file is plotted in a window. A directory or glob pattern is processed headless, in a process pool, into
+``<output-dir>/<name>.<format>`` and ``<name>.png`` per ride and ``summary.csv`` with one row per ride. ``<name>`` is
+the path of the ride relative to the directory, or to the part of the pattern before its first wildcard, so rides of
+the same name in different folders do not overwrite each other. Rides whose size, mtime and settings match their
+summary row and whose outputs exist are skipped on re-runs:
+
+    python3 stats.py "archive/*.tcx" --output-dir stats --format parquet --kph
+"""
+
 import argparse
-from datetime import timedelta
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
 from pathlib import Path
+from typing import Dict, Optional
 
 import matplotlib.pyplot as plt
 import pandas as pd
-from tcxreader.tcxreader import TCXReader, TCXTrackPoint
-from tqdm import tqdm
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
 
-MPS_TO_KPH = 3.6
-MPS_TO_MPH = 2.23694
+# The TCX parser is shared with the legacy dashboard and the ride summary kernel with the Strava one
+sys.path.append(str(Path(__file__).resolve().parent.parent / "app"))
+sys.path.append(str(Path(__file__).resolve().parents[2] / "app"))
+from summary import get_ride_summary  # noqa: E402
+from tcx import read_tcx  # noqa: E402
 
+COLUMNS = ["distance", "speed", "power", "cadence", "latitude", "longitude", "elevation", "heart_rate"]
+SUMMARY_FILENAME = "summary.csv"
+PLOT_FORMAT = "png"
 
-def main(args):
-    reader = TCXReader()
-    input_file = Path(args.input_file)
-    activity_name = input_file.stem
-    data = reader.read(str(input_file))
-
-    trackpoint_data = []
-    trackpoint: TCXTrackPoint
-
-    timezone_offset = timedelta(hours=args.timezone)
-
-    for trackpoint in tqdm(data.trackpoints):
-        time_adjusted = trackpoint.time + timezone_offset
-        speed = trackpoint.tpx_ext.get("Speed")
-        speed = speed * (MPS_TO_KPH if args.kph else MPS_TO_MPH)
-
-        trackpoint_data.append(
-            {
-                "time": time_adjusted,
-                "speed": speed,
-                "power": trackpoint.tpx_ext.get("Watts"),
-                "cadence": trackpoint.cadence,
-                "latitude": trackpoint.latitude,
-                "longitude": trackpoint.longitude,
-                "elevation": trackpoint.elevation,
-                "heart_rate": trackpoint.hr_value,
-            }
-        )
 
-    df = pd.DataFrame(trackpoint_data)
-    df.set_index("time", inplace=True)
+def read_ride(input_file: Path, kph: bool, timezone: int) -> pd.DataFrame:
+    return read_tcx(input_file, columns=COLUMNS, speed_unit="kph" if kph else "mph", timezone_offset=timezone)
 
-    if args.save_csv:
-        output_file = input_file.with_suffix(".csv")
-        df.to_csv(output_file)
-        print(f"Processed data saved to {output_file}")
 
-    fig, ax1 = plt.subplots()
+def plot_ride(ax1: Axes, df: pd.DataFrame, title: str, kph: bool):
     ax2 = ax1.twinx()
 
     # Plot the speed on the first y-axis
     ax1.plot(df.index, df["speed"], label="Speed", color="blue")
-    ax1.set_ylabel("Speed (km/h)" if args.kph else "Speed (mph)")
+    ax1.set_ylabel("Speed (km/h)" if kph else "Speed (mph)")
     ax1.legend(loc="upper left")
 
     # Plot the elevation on the second y-axis
@@ -61,14 +51,146 @@ def main(args):
     ax2.set_ylabel("Elevation (m)")
     ax2.legend(loc="upper right")
 
-    plt.xlabel("Time")
-    plt.title(activity_name)
+    ax1.set_xlabel("Time")
+    ax1.set_title(title)
+
+
+def main(args):
+    input_file = Path(args.input)
+    activity_name = input_file.stem
+    df = read_ride(input_file, args.kph, args.timezone)
+
+    if args.save_csv:
+        output_file = input_file.with_suffix(".csv")
+        df.to_csv(output_file)
+        print(f"Processed data saved to {output_file}")
+
+    _, ax1 = plt.subplots()
+    plot_ride(ax1, df, activity_name, args.kph)
     plt.show()
 
 
+def _output_paths(name: str, output_dir: Path, data_format: str):
+    output_path = output_dir / name
+    return output_path.with_suffix(f".{data_format}"), output_path.with_suffix(f".{PLOT_FORMAT}")
+
+
+def process_ride(input_file: Path, name: str, output_dir: Path, data_format: str, kph: bool, timezone: int) -> dict:
+    """Convert a ride and plot it without a display, run in the worker processes. Returns its summary row."""
+    stat = input_file.stat()
+    df = read_ride(input_file, kph, timezone)
+    data_path, plot_path = _output_paths(name, output_dir, data_format)
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Unique per process, written in place only once complete
+    tmp_path = data_path.with_suffix(f".{os.getpid()}.tmp")
+    if data_format == "parquet":
+        df.to_parquet(tmp_path)
+    else:
+        df.to_csv(tmp_path)
+    tmp_path.replace(data_path)
+
+    # A Figure without pyplot renders with Agg and is never registered with a GUI backend
+    fig = Figure(figsize=(12, 6))
+    plot_ride(fig.subplots(), df, input_file.stem, kph)
+    tmp_path = plot_path.with_suffix(f".{os.getpid()}.tmp")
+    fig.savefig(tmp_path, format=PLOT_FORMAT)
+    tmp_path.replace(plot_path)
+
+    summary = get_ride_summary(
+        power=df["power"].to_numpy(),
+        speed=df["speed"].to_numpy(),
+        cadence=df["cadence"].to_numpy(),
+        elevation=df["elevation"].to_numpy(),
+        distance=df["distance"].to_numpy(),
+    )
+    heart_rate = df["heart_rate"].dropna()
+    return {
+        "name": name,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "speed_unit": "kph" if kph else "mph",
+        "timezone": timezone,
+        "start_time": df.index[0] if len(df) else pd.NaT,
+        "elapsed_time": (df.index[-1] - df.index[0]).total_seconds() if len(df) else 0.0,
+        **asdict(summary),
+        "average_heart_rate": heart_rate.mean(),
+        "max_heart_rate": heart_rate.max(),
+    }
+
+
+def list_inputs(pattern: str) -> Dict[str, Path]:
+    """TCX files of a directory or matching a glob pattern by their path relative to it, sorted by path."""
+    path = Path(pattern)
+    if path.is_dir():
+        base, files = path, path.glob("*.tcx")
+    else:
+        # The directories of the pattern before its first wildcard
+        parts = path.parts
+        literal = next((i for i, part in enumerate(parts) if any(char in part for char in "*?[")), len(parts) - 1)
+        base, files = Path(*parts[:literal]) if literal else Path("."), map(Path, glob.glob(pattern, recursive=True))
+    return {file.relative_to(base).as_posix(): file for file in sorted(files)}
+
+
+def load_summary(output_dir: Path) -> pd.DataFrame:
+    summary_path = output_dir / SUMMARY_FILENAME
+    if not summary_path.exists():
+        return pd.DataFrame(index=pd.Index([], dtype="object", name="name"))
+    return pd.read_csv(summary_path, index_col="name", parse_dates=["start_time"])
+
+
+def batch(args, max_workers: Optional[int] = None):
+    inputs = list_inputs(args.input)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    summary = load_summary(output_dir)
+
+    rows, to_process = {}, {}
+    for name, input_file in inputs.items():
+        stat = input_file.stat()
+        up_to_date = (
+            name in summary.index
+            and tuple(summary.loc[name, ["size", "mtime_ns", "speed_unit", "timezone"]])
+            == (stat.st_size, stat.st_mtime_ns, "kph" if args.kph else "mph", args.timezone)
+            and all(path.exists() for path in _output_paths(name, output_dir, args.format))
+        )
+        if up_to_date:
+            rows[name] = summary.loc[name].to_dict()
+        else:
+            to_process[name] = input_file
+    print(f"{len(inputs)} TCX files, {len(inputs) - len(to_process)} up to date, {len(to_process)} to process")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                process_ride, input_file, name, output_dir, args.format, args.kph, args.timezone
+            ): input_file
+            for name, input_file in to_process.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            input_file = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(futures)}] {input_file} failed: {e!r}")
+                continue
+            rows[row.pop("name")] = row
+            print(f"[{done}/{len(futures)}] {input_file}")
+
+    new_summary = pd.DataFrame.from_dict(rows, orient="index").rename_axis("name").sort_index()
+    tmp_path = output_dir / f"{SUMMARY_FILENAME}.{os.getpid()}.tmp"
+    new_summary.to_csv(tmp_path)
+    tmp_path.replace(output_dir / SUMMARY_FILENAME)
+    print(f"Summary of {len(new_summary)} rides saved to {output_dir / SUMMARY_FILENAME}, {failed} failed")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process TCX files for ride data visualization.")
-    parser.add_argument("input_file", type=str, help="Path to the TCX file to process.")
+    parser.add_argument(
+        "input", type=str, help="Path to the TCX file to process, or a directory or glob pattern of TCX files."
+    )
     parser.add_argument("--kph", action="store_true", help="Convert speed from mph to kph.")
     parser.add_argument(
         "--timezone",
@@ -77,5 +199,15 @@ if __name__ == "__main__":
         help="Timezone offset in hours (default is 8 for HKT).",
     )
     parser.add_argument("--save-csv", action="store_true", help="Save the processed data to a CSV file.")
+    parser.add_argument(
+        "--output-dir", type=str, default="stats", help="Output directory of a directory or glob (default is stats)."
+    )
+    parser.add_argument(
+        "--format", choices=["csv", "parquet"], default="csv", help="Format of the converted rides (default is csv)."
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Processes converting rides (default is CPU count).")
     args = parser.parse_args()
-    main(args)
+    if Path(args.input).is_file():
+        main(args)
+    else:
+        batch(args, args.workers)
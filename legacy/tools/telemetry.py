@@ -0,0 +1,67 @@
+"""Telemetry values of every video frame, looked up once from the ride samples by the frame timestamps."""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+TRACK_COLUMNS = ["Speed", "Power", "Elevation"]
+
+
+class TelemetryTrack:
+    """Rounded overlay values per frame, the first frame shown at ``start_time``."""
+
+    def __init__(self, start_time: pd.Timestamp, fps: float, values: np.ndarray):
+        self.start_time = start_time
+        self.fps = fps
+        # (num_frames, len(TRACK_COLUMNS)) int64
+        self.values = values
+
+    @classmethod
+    def from_df(
+        cls,
+        df: pd.DataFrame,
+        start_time: pd.Timestamp,
+        fps: float,
+        num_frames: int,
+        interpolate: bool = False,
+        smooth: Optional[float] = None,
+    ) -> "TelemetryTrack":
+        """Sample the ride at the timestamp of each frame.
+
+        Each frame shows the last sample at or before its timestamp, or the value interpolated between the
+        samples around it. ``smooth`` averages the samples over a centered window of that many seconds first.
+        Frames before the first sample or more than a second after the last one show zeros.
+        """
+        samples = df[TRACK_COLUMNS].astype("float64")
+        samples["Power"] = samples["Power"].fillna(0.0)
+        samples = samples.ffill().fillna(0.0)
+        if smooth:
+            samples = samples.rolling(pd.Timedelta(seconds=smooth), center=True, min_periods=1).mean()
+
+        sample_seconds = (samples.index - start_time).total_seconds().to_numpy()
+        frame_seconds = np.arange(num_frames) / fps
+        values = np.zeros((num_frames, len(TRACK_COLUMNS)))
+        covered = (frame_seconds >= sample_seconds[0]) & (frame_seconds < sample_seconds[-1] + 1)
+        if interpolate:
+            for i, column in enumerate(TRACK_COLUMNS):
+                values[covered, i] = np.interp(frame_seconds[covered], sample_seconds, samples[column].to_numpy())
+        else:
+            positions = np.searchsorted(sample_seconds, frame_seconds[covered], side="right") - 1
+            values[covered] = samples.to_numpy()[positions]
+        return cls(start_time, fps, np.round(values).astype(np.int64))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, frames: slice) -> "TelemetryTrack":
+        """Track of a range of frames."""
+        start = frames.indices(len(self))[0]
+        return TelemetryTrack(self.timestamp(start), self.fps, self.values[frames])
+
+    def timestamp(self, idx: int) -> pd.Timestamp:
+        return self.start_time + pd.Timedelta(seconds=idx / self.fps)
+
+    def text_rows(self, idx: int) -> List[Tuple[str, str]]:
+        speed, power, elevation = self.values[idx]
+        return [("KMH", str(speed)), ("PWR", str(power)), ("ALT", str(elevation))]
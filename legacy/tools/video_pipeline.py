@@ -0,0 +1,197 @@
+"""Pipelined decode, render and encode of video frames.
+
+A decoder thread reads frames into a bounded queue of render jobs, a pool of render threads draws the overlays and
+the calling thread encodes the rendered frames in their original order. OpenCV and NumPy release the GIL while they
+work, so decoding, rendering and encoding overlap instead of running one after the other.
+"""
+
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+import cv2
+import numpy as np
+
+# Tells the encoder that the decoder is done
+_END = object()
+
+
+class StageCounter:
+    """Frames processed by a pipeline stage and the time spent on them, summed over its threads."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.frames += 1
+            self.busy += seconds
+
+    @property
+    def fps(self) -> float:
+        """Throughput of a single thread of the stage."""
+        return self.frames / self.busy if self.busy else 0.0
+
+
+class PipelineStats:
+    """Per-stage counters of a pipeline run."""
+
+    def __init__(self):
+        self.stages = {name: StageCounter(name) for name in ("decode", "render", "encode")}
+        self.started = time.monotonic()
+
+    @property
+    def fps(self) -> float:
+        """Frames encoded per second of wall-clock time."""
+        elapsed = time.monotonic() - self.started
+        return self.stages["encode"].frames / elapsed if elapsed else 0.0
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{stage.name} {stage.fps:.1f}" for stage in self.stages.values())
+        return f"{self.fps:.1f} FPS (per thread: {stages})"
+
+
+class FFmpegWriter:
+    """Pipes raw BGR frames to an ffmpeg subprocess, with the interface of ``cv2.VideoWriter``."""
+
+    def __init__(self, filename: str, fps: float, size: tuple, codec: str = "libx264"):
+        if shutil.which("ffmpeg") is None:
+            raise RuntimeError("ffmpeg not found on PATH")
+        width, height = size
+        # fmt: off
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-c:v", codec, "-pix_fmt", "yuv420p", filename,
+        ]
+        # fmt: on
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray):
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}")
+
+
+def open_writer(filename: str, fps: float, size: tuple, ffmpeg: bool = False, codec: str = "libx264"):
+    if ffmpeg:
+        return FFmpegWriter(filename, fps, size, codec=codec)
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"avc1"), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"Cannot open {filename} for writing with the avc1 codec, try --ffmpeg")
+    return writer
+
+
+def concat_videos(paths: List[Path], filename: str):
+    """Concatenate videos encoded with the same parameters into one file, without re-encoding."""
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", dir=Path(filename).parent, delete=False) as list_file:
+        list_file.writelines(f"file '{path.resolve()}'\n" for path in paths)
+    # fmt: off
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_file.name, "-c", "copy", filename,
+    ]
+    # fmt: on
+    try:
+        subprocess.run(command, check=True)
+    finally:
+        Path(list_file.name).unlink()
+
+
+def run_pipeline(
+    cap: cv2.VideoCapture,
+    frame_data: Callable[[int], Any],
+    render: Callable[[np.ndarray, Any], np.ndarray],
+    encode: Callable[[int, np.ndarray, Any], bool],
+    num_frames: Optional[int] = None,
+    workers: int = 4,
+    queue_size: int = 8,
+    progress: Optional[Callable[[int, Any, PipelineStats], None]] = None,
+    progress_every: int = 30,
+) -> PipelineStats:
+    """Decode up to ``num_frames`` frames from the capture, render and encode them.
+
+    ``frame_data(idx)`` is called in decoding order and its result passed to ``render(frame, data)``, which runs on
+    the render threads. ``encode(idx, frame, data)`` runs on the calling thread in frame order and stops the
+    pipeline by returning False. At most ``queue_size`` decoded frames wait for their render and encode.
+    ``progress(idx, data, stats)`` is called after every ``progress_every`` encoded frames.
+    """
+    stats = PipelineStats()
+    counters = stats.stages
+    jobs: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    decode_error = []
+
+    def put(job) -> bool:
+        while not stop.is_set():
+            try:
+                jobs.put(job, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def render_job(frame: np.ndarray, data: Any) -> np.ndarray:
+        t1 = time.monotonic()
+        frame = render(frame, data)
+        counters["render"].add(time.monotonic() - t1)
+        return frame
+
+    def decode(executor: ThreadPoolExecutor):
+        try:
+            idx = 0
+            while not stop.is_set() and (num_frames is None or idx < num_frames):
+                t1 = time.monotonic()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                data = frame_data(idx)
+                counters["decode"].add(time.monotonic() - t1)
+                if not put((idx, data, executor.submit(render_job, frame, data))):
+                    break
+                idx += 1
+        except BaseException as e:
+            decode_error.append(e)
+        finally:
+            put(_END)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render") as executor:
+        decoder = threading.Thread(target=decode, args=(executor,), name="decode", daemon=True)
+        decoder.start()
+        try:
+            while True:
+                job = jobs.get()
+                if job is _END:
+                    break
+                idx, data, future = job
+                frame = future.result()
+                t1 = time.monotonic()
+                keep_going = encode(idx, frame, data)
+                counters["encode"].add(time.monotonic() - t1)
+                if not keep_going:
+                    break
+                if progress is not None and idx % progress_every == 0:
+                    progress(idx, data, stats)
+        finally:
+            stop.set()
+            decoder.join()
+            # Skip the renders still queued when the pipeline stopped early
+            while not jobs.empty():
+                job = jobs.get_nowait()
+                if job is not _END:
+                    job[2].cancel()
+    if decode_error:
+        raise decode_error[0]
+    return stats